@@ -0,0 +1,31 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.masters
+    ~~~~~~~~~~~~~~~~~~
+
+    Generated master images shared by the thumbnailer benchmarks.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals
+
+from io import BytesIO
+
+from PIL import Image, ImageDraw, ImageFilter
+
+
+def make_master(size, fmt):
+    "return bytes of a photo like master image"
+
+    img = Image.effect_mandelbrot(size, (-2.2, -1.2, 1.0, 1.2), 80)
+    img = Image.merge("RGB", (
+        img, img.filter(ImageFilter.BLUR), Image.linear_gradient("L").resize(size)
+    ))
+    draw = ImageDraw.Draw(img)
+    for i in range(0, size[0], 97):
+        draw.line((i, 0, size[0] - i, size[1]), fill=(255, 255, 255), width=3)
+    if fmt == "GIF":
+        img = img.convert("P")
+    buf = BytesIO()
+    img.save(buf, fmt)
+    return buf.getvalue()
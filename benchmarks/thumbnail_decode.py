@@ -0,0 +1,77 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.thumbnail_decode
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Compare full resolution decoding of master images against the reduced
+    resolution path of djam.thumbnailer.reduce_master.
+
+    usage : python benchmarks/thumbnail_decode.py [repeat]
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, print_function, division
+
+import sys, math, time
+from io import BytesIO
+
+from django.conf import settings
+settings.configure()
+
+from PIL import Image, ImageChops, ImageStat
+
+from djam.thumbnailer import render_thumbnail
+
+from masters import make_master
+
+MASTERS = [((4000, 3000), "JPEG"), ((2400, 1600), "PNG")]
+TARGETS = [(200, 200), (640, 480)]
+
+
+def timeit(func, repeat):
+    best = None
+    for i in range(repeat):
+        t = time.time()
+        rv = func()
+        t = time.time() - t
+        best = t if best is None else min(best, t)
+    return best, rv
+
+
+def psnr(a, b):
+    "peak signal to noise ratio in dB in between 2 images"
+
+    diff = ImageChops.difference(Image.open(BytesIO(a)).convert("RGB"),
+                                 Image.open(BytesIO(b)).convert("RGB"))
+    mse = sum(ImageStat.Stat(diff).sum2) / (3 * diff.size[0] * diff.size[1])
+    if mse == 0:
+        return float('inf')
+    return 10 * math.log10(255 ** 2 / mse)
+
+
+def main(repeat=5):
+
+    print("%-18s %-10s %10s %10s %8s %8s" % (
+        "master", "target", "full ms", "fast ms", "speedup", "psnr dB"
+    ))
+
+    for size, fmt in MASTERS:
+        data = make_master(size, fmt)
+        for target in TARGETS:
+            tfull, full = timeit(
+                lambda: render_thumbnail(BytesIO(data), target, fmt, False),
+                repeat
+            )
+            tfast, fast = timeit(
+                lambda: render_thumbnail(BytesIO(data), target, fmt, True),
+                repeat
+            )
+            print("%-18s %-10s %10.1f %10.1f %7.1fx %8.1f" % (
+                "%s %ix%i" % (fmt, size[0], size[1]),
+                "%ix%i" % target, 1000 * tfull, 1000 * tfast,
+                tfull / tfast, psnr(full, fast)
+            ))
+
+
+if __name__ == '__main__':
+    main(*[int(a) for a in sys.argv[1:2]])
@@ -0,0 +1,318 @@
+# -*- coding: utf-8 -*-
+"""
+    benchmarks.thumbnailer_load
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Throughput, latency & memory of the Thumbnailer view, called in process
+    against a FileSystemStorage holding generated master images.
+
+    Scenarios :
+        * cold : every request renders & saves a new thumbnail
+        * warm : every request is served from a saved thumbnail
+        * burst : threads concurrently request the same new thumbnails
+
+    Each scenario runs in a forked process so that its peak resident memory
+    can be reported.
+
+    usage : python benchmarks/thumbnailer_load.py [--rounds N] [--threads N]
+                [--save baseline.json] [--compare baseline.json]
+
+    When comparing, the script exits with status 1 if the throughput of a
+    scenario dropped or its p99 latency grew by more than --tolerance.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, print_function, division
+
+import os, sys, json, time, shutil, platform, tempfile, threading, argparse
+import multiprocessing
+
+from django.conf import settings
+settings.configure()
+
+import django
+if hasattr(django, 'setup'):
+    django.setup()
+
+import PIL
+
+from django.core.files.storage import FileSystemStorage
+from django.test import RequestFactory
+
+from djam.thumbnailer import Thumbnailer, build_thumbnail_path
+
+from masters import make_master
+
+MASTERS = [
+    ("photo.jpg", (4000, 3000), "JPEG"),
+    ("small.jpg", (1200, 800), "JPEG"),
+    ("drawing.png", (2400, 1600), "PNG"),
+    ("anim.gif", (800, 600), "GIF"),
+]
+WIDTHS = [64, 120, 200, 320, 480, 640]
+
+_clock = getattr(time, 'perf_counter', time.time)
+
+
+def make_storage(fixtures):
+    "return FileSystemStorage in a new directory holding fixtures masters"
+
+    location = tempfile.mkdtemp(prefix="djam-bench-")
+    for name, data in fixtures.items():
+        with open(os.path.join(location, name), "wb") as f:
+            f.write(data)
+    return FileSystemStorage(location=location, base_url="/")
+
+
+def thumbnail_paths(offset=0):
+    "return thumbnail paths of all the masters, offset makes them distinct"
+
+    return [
+        build_thumbnail_path(name, w + offset, (w + offset) * 3 // 4)
+        for name, size, fmt in MASTERS for w in WIDTHS
+    ]
+
+
+def fetch(view, rf, path):
+    "return latency of one request, raise if thumbnail was not served"
+
+    started = _clock()
+    resp = view(rf.get("/thumbs/%s" % path), path=path)
+    if resp.status_code != 200:
+        raise RuntimeError("%s : status %i" % (path, resp.status_code))
+    if resp.streaming:
+        for chunk in resp.streaming_content:
+            pass
+        resp.close()
+    return _clock() - started
+
+
+def scenario_cold(fixtures, rounds, threads):
+
+    storage = make_storage(fixtures)
+    try:
+        view = Thumbnailer.as_view(storage=storage, saveThumbnail=True)
+        rf = RequestFactory()
+        latencies = []
+        started = _clock()
+        for r in range(rounds):
+            for path in thumbnail_paths(r):
+                latencies.append(fetch(view, rf, path))
+        return latencies, _clock() - started
+    finally:
+        shutil.rmtree(storage.location)
+
+
+def scenario_warm(fixtures, rounds, threads):
+
+    storage = make_storage(fixtures)
+    try:
+        view = Thumbnailer.as_view(storage=storage, saveThumbnail=True)
+        rf = RequestFactory()
+        paths = thumbnail_paths()
+        for path in paths:
+            fetch(view, rf, path)
+
+        latencies = []
+        started = _clock()
+        for r in range(rounds):
+            for path in paths:
+                latencies.append(fetch(view, rf, path))
+        return latencies, _clock() - started
+    finally:
+        shutil.rmtree(storage.location)
+
+
+def scenario_burst(fixtures, rounds, threads):
+
+    storage = make_storage(fixtures)
+    try:
+        view = Thumbnailer.as_view(storage=storage, saveThumbnail=True)
+        rf = RequestFactory()
+        latencies = []
+        errors = []
+        lock = threading.Lock()
+
+        def client(paths, go):
+            go.wait()
+            try:
+                for path in paths:
+                    t = fetch(view, rf, path)
+                    with lock:
+                        latencies.append(t)
+            except Exception as exc:
+                errors.append(exc)
+
+        started = _clock()
+        for r in range(rounds):
+            # every client asks the same not yet rendered thumbnails
+            paths = thumbnail_paths(r)
+            go = threading.Event()
+            clients = [
+                threading.Thread(target=client, args=(paths, go))
+                for i in range(threads)
+            ]
+            for c in clients:
+                c.start()
+            go.set()
+            for c in clients:
+                c.join()
+        elapsed = _clock() - started
+
+        if errors:
+            raise errors[0]
+        return latencies, elapsed
+    finally:
+        shutil.rmtree(storage.location)
+
+
+SCENARIOS = [
+    ("cold", scenario_cold),
+    ("warm", scenario_warm),
+    ("burst", scenario_burst),
+]
+
+
+def percentile(values, p):
+    values = sorted(values)
+    k = min(len(values) - 1, int(round(p / 100 * (len(values) - 1))))
+    return values[k]
+
+
+def peak_rss():
+    "return peak resident memory of this process in bytes or None"
+
+    try:
+        import resource
+    except ImportError:
+        return None
+    maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # macOS reports bytes, linux KiB
+    return maxRss if sys.platform == 'darwin' else maxRss * 1024
+
+
+def _run_scenario(func, fixtures, rounds, threads, queue):
+    "run in child process, put summary or error in queue"
+
+    try:
+        latencies, elapsed = func(fixtures, rounds, threads)
+        queue.put(dict(
+            requests=len(latencies),
+            opsPerSec=len(latencies) / elapsed,
+            p50Ms=1000 * percentile(latencies, 50),
+            p99Ms=1000 * percentile(latencies, 99),
+            peakRss=peak_rss(),
+        ))
+    except Exception as exc:
+        queue.put(dict(error="%s: %s" % (exc.__class__.__name__, exc)))
+
+
+def run(rounds, threads, names=None):
+    "return dict of scenarios summaries"
+
+    fixtures = dict(
+        (name, make_master(size, fmt)) for name, size, fmt in MASTERS
+    )
+
+    results = {}
+    for name, func in SCENARIOS:
+        if names and name not in names:
+            continue
+        queue = multiprocessing.Queue()
+        proc = multiprocessing.Process(
+            target=_run_scenario,
+            args=(func, fixtures, rounds, threads, queue)
+        )
+        proc.start()
+        summary = queue.get()
+        proc.join()
+        if 'error' in summary:
+            raise RuntimeError("%s scenario failed : %s" % (name, summary['error']))
+        results[name] = summary
+    return results
+
+
+def environment():
+    return dict(
+        python=platform.python_version(),
+        django=django.get_version(),
+        pillow=getattr(PIL, '__version__', None) or getattr(PIL, 'PILLOW_VERSION', None),
+        platform=platform.platform(),
+        cpus=multiprocessing.cpu_count(),
+    )
+
+
+def report(results, baseline=None, tolerance=0.1):
+    "print results table, return names of regressed scenarios"
+
+    print("%-8s %8s %10s %10s %10s %10s   %s" % (
+        "scenario", "requests", "ops/s", "p50 ms", "p99 ms", "peak MB",
+        "vs baseline" if baseline else ""
+    ))
+
+    regressed = []
+    for name, func in SCENARIOS:
+        rv = results.get(name)
+        if rv is None:
+            continue
+
+        delta = ""
+        ref = (baseline or {}).get(name)
+        if ref:
+            ops = rv['opsPerSec'] / ref['opsPerSec'] - 1
+            p99 = rv['p99Ms'] / ref['p99Ms'] - 1
+            delta = "ops/s %+.1f%%, p99 %+.1f%%" % (100 * ops, 100 * p99)
+            if ops < -tolerance or p99 > tolerance:
+                regressed.append(name)
+                delta += "  REGRESSION"
+
+        peak = rv['peakRss']
+        print("%-8s %8i %10.1f %10.2f %10.2f %10s   %s" % (
+            name, rv['requests'], rv['opsPerSec'], rv['p50Ms'], rv['p99Ms'],
+            "%.1f" % (peak / 1024 ** 2) if peak else "-", delta
+        ))
+    return regressed
+
+
+def main(argv=None):
+
+    parser = argparse.ArgumentParser(description="Thumbnailer benchmarks")
+    parser.add_argument('--rounds', type=int, default=3,
+                        help="passes over the thumbnail set per scenario")
+    parser.add_argument('--threads', type=int, default=8,
+                        help="concurrent clients of burst scenario")
+    parser.add_argument('--scenario', action='append', dest='scenarios',
+                        choices=[n for n, f in SCENARIOS],
+                        help="scenario to run, may be repeated, default all")
+    parser.add_argument('--save', metavar='FILE',
+                        help="save results as JSON baseline")
+    parser.add_argument('--compare', metavar='FILE',
+                        help="compare results with JSON baseline")
+    parser.add_argument('--tolerance', type=float, default=0.1,
+                        help="relative slowdown reported as regression")
+    args = parser.parse_args(argv)
+
+    baseline = None
+    if args.compare:
+        with open(args.compare) as f:
+            baseline = json.load(f)
+        print("baseline : %s" % json.dumps(baseline.get('environment')))
+
+    results = run(args.rounds, args.threads, args.scenarios)
+    regressed = report(
+        results, baseline and baseline['scenarios'], args.tolerance
+    )
+
+    if args.save:
+        with open(args.save, 'w') as f:
+            json.dump(dict(
+                environment=environment(),
+                options=dict(rounds=args.rounds, threads=args.threads),
+                scenarios=results,
+            ), f, indent=2, sort_keys=True)
+
+    return 1 if regressed else 0
+
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,395 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.aiosmtp
+    ~~~~~~~~~~~~
+
+    Email backend delivering messages over several concurrent SMTP
+    connections driven by asyncio (python 3.5+), eg :
+
+        EMAIL_BACKEND = 'djam.aiosmtp.AsyncEmailBackend'
+        EMAIL_CONNECTIONS = 8
+
+    Backend uses the EMAIL_HOST, EMAIL_PORT, EMAIL_HOST_USER,
+    EMAIL_HOST_PASSWORD, EMAIL_USE_TLS, EMAIL_USE_SSL & EMAIL_TIMEOUT
+    settings as the django smtp backend does. Commands are pipelined when
+    the server advertises PIPELINING.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import, division
+
+import re, ssl, time, base64, asyncio, smtplib, logging
+
+from django.conf import settings
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.mail.message import sanitize_address
+from django.core.mail.utils import DNS_NAME
+from django.utils.encoding import force_bytes, force_text
+
+__all__ = ['AsyncSMTPConnection', 'AsyncEmailBackend']
+
+logger = logging.getLogger(__name__)
+
+_leadingDot = re.compile(br"^\.", re.M)
+
+
+class AsyncSMTPConnection(object):
+    """
+    Minimal asyncio SMTP client, errors are reported raising smtplib
+    exceptions.
+    """
+
+    def __init__(self, host, port, timeout=None, useSsl=False, useTls=False,
+                 username=None, password=None, localHostname=None):
+
+        self.host = host
+        self.port = port
+        self.timeout = timeout
+        self.useSsl = useSsl
+        self.useTls = useTls
+        self.username = username
+        self.password = password
+        self.localHostname = localHostname or str(DNS_NAME)
+
+        self.reader = self.writer = None
+        self.extensions = set()
+
+    async def _wait(self, coro):
+        if self.timeout:
+            return await asyncio.wait_for(coro, self.timeout)
+        return await coro
+
+    async def read_reply(self):
+        "return (code, text) of server reply"
+
+        lines = []
+        while True:
+            line = await self._wait(self.reader.readline())
+            if not line:
+                raise smtplib.SMTPServerDisconnected("connection closed")
+            lines.append(line[4:].strip())
+            if line[3:4] != b"-":
+                break
+        try:
+            code = int(line[:3])
+        except ValueError:
+            raise smtplib.SMTPResponseException(-1, line)
+        return code, b"\n".join(lines)
+
+    async def write(self, data):
+        self.writer.write(data)
+        await self._wait(self.writer.drain())
+
+    async def command(self, line, expected=250):
+        await self.write(force_bytes(line) + b"\r\n")
+        code, text = await self.read_reply()
+        if code != expected:
+            raise smtplib.SMTPResponseException(code, text)
+        return text
+
+    async def ehlo(self):
+        text = await self.command("EHLO %s" % self.localHostname)
+        self.extensions = set(
+            force_text(l).split(" ", 1)[0].upper() for l in text.split(b"\n")[1:]
+        )
+
+    async def connect(self):
+
+        context = ssl.create_default_context() if self.useSsl else None
+        self.reader, self.writer = await self._wait(asyncio.open_connection(
+            self.host, self.port, ssl=context
+        ))
+
+        code, text = await self.read_reply()
+        if code != 220:
+            raise smtplib.SMTPConnectError(code, text)
+        await self.ehlo()
+
+        if self.useTls:
+            await self.command("STARTTLS", 220)
+            await self.start_tls()
+            await self.ehlo()
+
+        if self.username and self.password:
+            token = base64.b64encode(force_bytes(
+                "\0%s\0%s" % (self.username, self.password)
+            ))
+            try:
+                await self.command(b"AUTH PLAIN " + token, 235)
+            except smtplib.SMTPResponseException as exc:
+                raise smtplib.SMTPAuthenticationError(exc.smtp_code, exc.smtp_error)
+
+    async def start_tls(self):
+        "upgrade connection to TLS, requires python 3.7+"
+
+        context = ssl.create_default_context()
+        if hasattr(self.writer, 'start_tls'):
+            # python 3.11+
+            await self._wait(self.writer.start_tls(
+                context, server_hostname=self.host
+            ))
+            return
+
+        loop = asyncio.get_event_loop()
+        if not hasattr(loop, 'start_tls'):
+            raise smtplib.SMTPNotSupportedError("STARTTLS requires python 3.7+")
+
+        transport = self.writer.transport
+        tlsTransport = await self._wait(loop.start_tls(
+            transport, transport.get_protocol(), context,
+            server_hostname=self.host
+        ))
+        # stream reader & writer shall now use TLS transport
+        self.reader._transport = tlsTransport
+        self.writer._transport = tlsTransport
+
+    async def sendmail(self, sender, recipients, data):
+        """
+        send message data, return dict of refused recipients
+        raise SMTPSenderRefused, SMTPRecipientsRefused or SMTPDataError
+        """
+
+        commands = ["MAIL FROM:<%s>" % sender]
+        commands.extend("RCPT TO:<%s>" % r for r in recipients)
+        commands.append("DATA")
+
+        pipelining = 'PIPELINING' in self.extensions
+        replies = []
+        if pipelining:
+            await self.write(b"".join(force_bytes(c) + b"\r\n" for c in commands))
+            for c in commands:
+                replies.append(await self.read_reply())
+        else:
+            # DATA is only sent once envelope was accepted
+            for c in commands[:-1]:
+                await self.write(force_bytes(c) + b"\r\n")
+                replies.append(await self.read_reply())
+                if replies[0][0] != 250:
+                    break
+
+        # a pipelined DATA may have been accepted, abort it
+        dataAccepted = pipelining and replies[-1][0] == 354
+
+        code, text = replies[0]
+        if code != 250:
+            if dataAccepted:
+                await self.end_data(b"")
+            await self.reset()
+            raise smtplib.SMTPSenderRefused(code, text, sender)
+
+        refused = dict(
+            (r, reply) for r, reply in zip(recipients, replies[1:])
+            if reply[0] not in (250, 251)
+        )
+        if len(refused) == len(recipients):
+            if dataAccepted:
+                await self.end_data(b"")
+            await self.reset()
+            raise smtplib.SMTPRecipientsRefused(refused)
+
+        if pipelining:
+            code, text = replies[-1]
+        else:
+            await self.write(b"DATA\r\n")
+            code, text = await self.read_reply()
+        if code != 354:
+            await self.reset()
+            raise smtplib.SMTPDataError(code, text)
+
+        code, text = await self.end_data(data)
+        if code != 250:
+            raise smtplib.SMTPDataError(code, text)
+        return refused
+
+    async def end_data(self, data):
+        "send dot stuffed data and terminating dot, return server reply"
+
+        data = _leadingDot.sub(b"..", data)
+        if data and not data.endswith(b"\r\n"):
+            data += b"\r\n"
+        await self.write(data + b".\r\n")
+        return await self.read_reply()
+
+    async def reset(self):
+        try:
+            await self.command("RSET")
+        except smtplib.SMTPResponseException:
+            pass
+
+    async def quit(self):
+        try:
+            if self.writer is not None:
+                await self.command("QUIT", 221)
+        except (smtplib.SMTPException, OSError, asyncio.TimeoutError):
+            pass
+        finally:
+            self.close()
+
+    def close(self):
+        if self.writer is not None:
+            self.writer.close()
+        self.reader = self.writer = None
+
+
+class AsyncEmailBackend(BaseEmailBackend):
+    """
+    Django email backend sending messages over concurrent SMTP connections.
+
+    Messages are taken from email_messages as connections get ready to send
+    them, through a queue of at most queueSize messages. Hence a generator
+    of messages is consumed lazily keeping memory bounded, eg :
+
+        backend.send_messages(
+            msg for to, msg, error in template.iter_messages(recipients)
+            if msg is not None
+        )
+
+    After send_messages, connectionStats lists per connection statistics.
+    """
+
+    def __init__(self, host=None, port=None, username=None, password=None,
+                 use_tls=None, use_ssl=None, timeout=None, connections=None,
+                 queueSize=None, fail_silently=False, **kwargs):
+
+        super(AsyncEmailBackend, self).__init__(fail_silently=fail_silently)
+
+        self.host = host or settings.EMAIL_HOST
+        self.port = port or settings.EMAIL_PORT
+        self.username = settings.EMAIL_HOST_USER if username is None else username
+        self.password = settings.EMAIL_HOST_PASSWORD if password is None else password
+        self.useTls = settings.EMAIL_USE_TLS if use_tls is None else use_tls
+        self.useSsl = settings.EMAIL_USE_SSL if use_ssl is None else use_ssl
+        self.timeout = getattr(settings, 'EMAIL_TIMEOUT', None) if timeout is None else timeout
+
+        self.connections = connections or getattr(settings, 'EMAIL_CONNECTIONS', 4)
+        self.queueSize = queueSize or 2 * self.connections
+
+        self.connectionStats = []
+
+    def make_connection(self):
+        return AsyncSMTPConnection(
+            self.host, self.port, self.timeout, self.useSsl, self.useTls,
+            self.username, self.password
+        )
+
+    async def _deliver(self, conn, message):
+        "send one message, return number of bytes sent"
+
+        encoding = message.encoding or settings.DEFAULT_CHARSET
+        sender = sanitize_address(message.from_email, encoding)
+        recipients = [sanitize_address(a, encoding) for a in message.recipients()]
+        data = message.message().as_bytes(linesep='\r\n')
+        await conn.sendmail(sender, recipients, data)
+        return len(data)
+
+    async def open_connection(self):
+        "return connected AsyncSMTPConnection"
+
+        conn = self.make_connection()
+        try:
+            await conn.connect()
+        except BaseException:
+            conn.close()
+            raise
+        return conn
+
+    def _broken(self, conn, attempt, stats, errors, exc):
+        "close broken connection, count failure of last attempt"
+
+        if conn is not None:
+            conn.close()
+        if attempt:
+            stats['failed'] += 1
+            errors.append(exc)
+        return None
+
+    async def _worker(self, queue, stats, errors):
+        "send messages taken from queue until None is received"
+
+        conn = None
+        started = time.time()
+        try:
+            while True:
+                message = await queue.get()
+                if message is None:
+                    break
+
+                # a failed connection is retried once for every message
+                for attempt in (0, 1):
+                    try:
+                        if not message.recipients():
+                            break
+                        if conn is None:
+                            stats['connects'] += 1
+                            conn = await self.open_connection()
+                        stats['bytes'] += await self._deliver(conn, message)
+                        stats['sent'] += 1
+                        break
+
+                    except (smtplib.SMTPServerDisconnected,
+                            smtplib.SMTPConnectError) as exc:
+                        conn = self._broken(conn, attempt, stats, errors, exc)
+
+                    except smtplib.SMTPException as exc:
+                        # message was refused, connection is still usable
+                        stats['failed'] += 1
+                        errors.append(exc)
+                        break
+
+                    except (OSError, asyncio.TimeoutError) as exc:
+                        conn = self._broken(conn, attempt, stats, errors, exc)
+
+                    except Exception as exc:
+                        # message can not be encoded (eg BadHeaderError),
+                        # worker shall survive or producer would block
+                        stats['failed'] += 1
+                        errors.append(exc)
+                        break
+        finally:
+            if conn is not None:
+                await conn.quit()
+            stats['elapsed'] = time.time() - started
+            stats['rate'] = stats['sent'] / stats['elapsed'] if stats['elapsed'] else None
+
+    async def send_messages_async(self, email_messages):
+        "coroutine sending email_messages, return number of messages sent"
+
+        queue = asyncio.Queue(maxsize=self.queueSize)
+        errors = []
+        self.connectionStats = [
+            dict(connection=i, sent=0, failed=0, bytes=0, connects=0)
+            for i in range(self.connections)
+        ]
+        workers = [
+            asyncio.ensure_future(self._worker(queue, stats, errors))
+            for stats in self.connectionStats
+        ]
+        try:
+            # blocks while queue is full, connections setting the pace
+            for message in email_messages:
+                await queue.put(message)
+            for w in workers:
+                await queue.put(None)
+            await asyncio.gather(*workers)
+        except BaseException:
+            for w in workers:
+                w.cancel()
+            raise
+
+        if errors:
+            logger.warning("%i messages could not be sent, first error : %s",
+                           len(errors), errors[0])
+            if not self.fail_silently:
+                raise errors[0]
+
+        return sum(s['sent'] for s in self.connectionStats)
+
+    def send_messages(self, email_messages):
+
+        loop = asyncio.new_event_loop()
+        try:
+            return loop.run_until_complete(
+                self.send_messages_async(email_messages)
+            )
+        finally:
+            loop.close()
@@ -0,0 +1,203 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.apicache
+    ~~~~~~~~~~~~~
+
+    Server side caching of BaseApiResource responses, using a django cache
+    backend. Cached responses are tagged (eg with model or table names) so
+    that writes can invalidate them by tag.
+
+    Invalidation does not delete cached responses : each tag has a version
+    which takes part in the response cache key, invalidating a tag changes its
+    version hence stale responses can not be reached anymore and will expire.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import
+
+import hashlib
+from uuid import uuid4
+
+from django.core.cache import caches
+from django.utils.encoding import force_bytes
+
+__all__ = ['CachedResourceMixin', 'invalidate_tags']
+
+SAFE_METHODS = frozenset(['GET', 'HEAD'])
+
+_tagKey = "djam.apicache.tag.{0}".format
+
+
+def _new_version():
+    return uuid4().hex[:12]
+
+
+def get_tag_versions(tags, alias='default'):
+    "return list of current versions for tags, missing versions are created"
+
+    if not tags:
+        return []
+
+    cache = caches[alias]
+    keys = [_tagKey(t) for t in tags]
+    versions = cache.get_many(keys)
+
+    missing = dict((k, _new_version()) for k in keys if k not in versions)
+    if missing:
+        # a tag version shall never expire before the responses it protects
+        cache.set_many(missing, None)
+        versions.update(missing)
+
+    return [versions[k] for k in keys]
+
+
+def invalidate_tags(*tags, **kwargs):
+    """
+    make all the cached responses that were tagged with any of tags stale...
+    kwargs may contain alias of the django cache in use.
+    """
+
+    if tags:
+        cache = caches[kwargs.get('alias', 'default')]
+        cache.set_many(dict((_tagKey(t), _new_version()) for t in tags), None)
+
+
+class CachedResourceMixin(object):
+    """
+    BaseApiResource mixin providing the cache_lookup phase.
+    Mixin shall come first in the bases list, eg :
+
+        class ProductList(CachedResourceMixin, BaseApiResource):
+
+            cacheTags = ['product']
+            cacheQueryParams = ['page', 'category']
+
+            GET_PHASES = [
+                'check_permissions', 'cache_lookup', 'load_products', 'render'
+            ]
+            POST_PHASES = ['load_body', 'create_product']
+
+    A cached hit skips all the phases listed after cache_lookup, hence
+    authentication & authorization phases shall be listed before it.
+    Responses to authenticated requests are cached per user.
+    Unsafe verbs bypass the cache and when they succeed, invalidate cacheTags.
+    """
+
+    # name of the django cache in use
+    cacheAlias = 'default'
+
+    # time in seconds during which a response stays in the cache
+    cacheTimeout = 300
+
+    # tags attached to cached responses (eg model or table names)
+    cacheTags = ()
+
+    # query parameters taking part in the cache key, None means all...
+    cacheQueryParams = None
+
+    # request headers taking part in the cache key (eg 'Accept-Language')
+    cacheVary = ()
+
+    cacheKeyPrefix = "djam.apicache"
+
+    def get_cache_tags(self, request):
+        "return tags for the requested resource"
+
+        return self.cacheTags
+
+    def get_cache_vary(self, request):
+        """
+        return list of extra strings taking part in the cache key.
+        Overwrite this to cache per API key...
+        """
+
+        meta = request.META  # local alias
+        rv = []
+
+        # response rendered for a user shall not be served to others
+        user = getattr(request, 'user', None)
+        if user is not None and user.is_authenticated:
+            rv.append("user=%s" % user.pk)
+
+        for hdr in self.cacheVary:
+            name = hdr.upper().replace('-', '_')
+            if name not in ('CONTENT_TYPE', 'CONTENT_LENGTH'):
+                name = "HTTP_%s" % name
+            rv.append("%s=%s" % (hdr, meta.get(name, '')))
+        return rv
+
+    def get_cache_key(self, request):
+        "return key under which the response to request is cached"
+
+        query = request.GET  # local alias
+        params = self.cacheQueryParams
+        if params is None:
+            params = query.keys()
+        params = sorted(p for p in params if p in query)
+
+        parts = [request.method, request.path]
+        for p in params:
+            parts.extend(["%s=%s" % (p, v) for v in query.getlist(p)])
+        parts.extend(self.get_cache_vary(request))
+        parts.extend(get_tag_versions(
+            self.get_cache_tags(request), self.cacheAlias
+        ))
+
+        h = hashlib.sha1()
+        for p in parts:
+            h.update(force_bytes(p))
+            h.update(b"\0")
+
+        return "%s.%s" % (self.cacheKeyPrefix, h.hexdigest())
+
+    def cache_lookup(self, request):
+        "phase returning cached response if any"
+
+        if request.method not in SAFE_METHODS:
+            return
+
+        key = self.get_cache_key(request)
+        resp = caches[self.cacheAlias].get(key)
+        if resp is not None:
+            return resp
+
+        # mark request so that response is later stored
+        request.cache_key = key
+
+    def finalize_response(self, request, response):
+
+        response = super(CachedResourceMixin, self).finalize_response(
+            request, response
+        )
+
+        status = getattr(response, 'status_code', None)
+        if status is None:
+            return response
+
+        if request.method not in SAFE_METHODS:
+
+            # successful writes invalidate tagged responses
+            if 200 <= status < 300:
+                invalidate_tags(
+                    *self.get_cache_tags(request), alias=self.cacheAlias
+                )
+
+        else:
+
+            key = getattr(request, 'cache_key', None)
+            cacheable = (
+                key is not None and status == 200
+                and not response.streaming and not response.cookies
+            )
+            if cacheable:
+                cache = caches[self.cacheAlias]
+                timeout = self.cacheTimeout
+                if callable(getattr(response, 'render', None)) and \
+                        not response.is_rendered:
+                    response.add_post_render_callback(
+                        lambda r: cache.set(key, r, timeout)
+                    )
+                else:
+                    cache.set(key, response, timeout)
+
+        return response
@@ -0,0 +1,257 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.batch
+    ~~~~~~~~~~
+
+    Exports BatchResource, a phased view that multiplexes several api
+    resources calls in a single HTTP round trip.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import
+
+import os, json, logging, threading
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+
+from django.conf import settings
+from django.core.exceptions import PermissionDenied
+from django.core.handlers.wsgi import WSGIRequest
+from django.core.urlresolvers import resolve, Resolver404
+from django.http import Http404, HttpResponseBadRequest, QueryDict
+from django.http.response import HttpResponse
+from django.utils.encoding import force_bytes, smart_text, uri_to_iri
+from django.utils import six
+
+from .phased_views import BaseApiResource
+from .utils import SharedStateBase
+
+__all__ = ['BatchResource']
+
+logger = logging.getLogger(__name__)
+
+SAFE_METHODS = frozenset(['GET', 'HEAD'])
+
+_pools = {}
+_poolsLock = threading.Lock()
+
+
+def get_thread_pool(size):
+    "return ThreadPool of size threads shared by the batches of this process"
+
+    # pool threads do not survive fork
+    key = (os.getpid(), size)
+    pool = _pools.get(key)
+    if pool is None:
+        with _poolsLock:
+            pool = _pools.get(key)
+            if pool is None:
+                pool = _pools[key] = ThreadPool(size)
+    return pool
+
+
+class BatchResource(BaseApiResource):
+    """
+    Api resource that accepts a json list of sub requests, eg :
+
+        [
+            {"method": "GET", "path": "/api/user/12"},
+            {"method": "PUT", "path": "/api/user/12/prefs", "body": {...}}
+        ]
+
+    Each sub request is resolved against the URLconf and processed in-process
+    by the corresponding BaseApiResource. Sub requests share the batch
+    request user, session & cookies and run in the batch thread hence share
+    its sqlalchemy Session.
+
+    Response is a json list holding for each sub request :
+        {"status": 200, "headers": {...}, "body": ...}
+
+    If parallel is set to a number of threads (setting BATCH_PARALLEL),
+    consecutive safe (GET, HEAD) sub requests are run concurrently by a pool
+    of threads shared by all batches. As a sqlalchemy Session can not be
+    shared in between threads, each of those workers uses its own Session.
+
+    Sub request paths maybe absolute or relative to the script prefix the
+    application is mounted under.
+    """
+
+    # maximum number of sub requests in a batch
+    maxRequests = 20
+
+    # number of threads running safe sub requests, 0 disables parallelism
+    parallel = getattr(settings, 'BATCH_PARALLEL', 0)
+
+    POST_PHASES = ['load_body', 'run_batch']
+
+    def parse_batch(self, request):
+        "return list of (method, path, body) or raise ValueError"
+
+        subs = request.POST
+        if not isinstance(subs, list):
+            raise ValueError("batch shall be a json list")
+        if len(subs) > self.maxRequests:
+            raise ValueError("batch exceeds %i requests" % self.maxRequests)
+
+        rv = []
+        for sub in subs:
+            if not isinstance(sub, dict) or not sub.get('path'):
+                raise ValueError("invalid sub request %r" % (sub,))
+            method = sub.get('method', 'GET').upper()
+            rv.append((method, sub['path'], sub.get('body')))
+        return rv
+
+    def build_subrequest(self, request, method, path, body):
+        "return new request set to process method on path"
+
+        path, _, query = path.partition('?')
+
+        # strip script prefix of absolute path
+        prefix = request.path[:len(request.path) - len(request.path_info)]
+        prefix = prefix.rstrip('/')
+        if prefix and path.startswith(prefix + '/'):
+            path = path[len(prefix):]
+
+        # encode path_info as WSGI servers do
+        pathInfo = uri_to_iri(path).encode('utf-8')
+        if six.PY3:
+            pathInfo = pathInfo.decode('iso-8859-1')
+
+        environ = request.META.copy()
+        environ['REQUEST_METHOD'] = method
+        environ['PATH_INFO'] = pathInfo
+        environ['QUERY_STRING'] = query
+
+        if body is None:
+            body = b''
+            environ.pop('CONTENT_TYPE', None)
+        else:
+            if not isinstance(body, six.string_types):
+                body = json.dumps(body)
+            body = force_bytes(body)
+            environ['CONTENT_TYPE'] = 'application/json'
+        environ['CONTENT_LENGTH'] = str(len(body))
+        environ['wsgi.input'] = BytesIO(body)
+
+        # state set on batch request by middlewares or phases is not shared
+        # but for the client identity
+        sub = WSGIRequest(environ)
+        sub.GET = QueryDict(query, encoding=request.encoding)
+        sub.COOKIES = request.COOKIES
+        for attr in ('user', 'session'):
+            if hasattr(request, attr):
+                setattr(sub, attr, getattr(request, attr))
+
+        return sub
+
+    def call_resource(self, request, method, path, body):
+        "return response obtained processing sub request"
+
+        sub = self.build_subrequest(request, method, path, body)
+
+        try:
+            match = resolve(sub.path_info, getattr(request, 'urlconf', None))
+        except Resolver404:
+            return HttpResponse(status=404)
+
+        # only phased api resources can take part in a batch
+        viewClass = getattr(match.func, 'view_class', None)
+        batchable = (
+            isinstance(viewClass, type)
+            and issubclass(viewClass, BaseApiResource)
+            and not issubclass(viewClass, BatchResource)
+        )
+        if not batchable:
+            return HttpResponseBadRequest("%s is not batchable" % path)
+
+        sub.resolver_match = match
+
+        # make sub request the current global request
+        local = SharedStateBase()._local
+        saved = getattr(local, 'request', None)
+        local.request = sub
+        try:
+            response = match.func(sub, *match.args, **match.kwargs)
+
+            # batch bypasses the handler that renders TemplateResponse
+            if callable(getattr(response, 'render', None)):
+                response = response.render()
+            return response
+        except Http404:
+            return HttpResponse(status=404)
+        except PermissionDenied:
+            return HttpResponse(status=403)
+        except Exception:
+            logger.exception("batch sub request %s %s failed", method, path)
+            return HttpResponse(status=500)
+        finally:
+            local.request = saved
+
+    def call_resource_in_thread(self, args):
+        "call_resource version used by parallel workers..."
+
+        try:
+            return self.call_resource(*args)
+        finally:
+            try:
+                from .sqlalchemy import Session
+            except ImportError:
+                pass
+            else:
+                Session.remove()
+
+    def encode_response(self, response):
+        "return dict representation of a sub request response"
+
+        if response.streaming:
+            content = b''.join(response.streaming_content)
+        else:
+            content = response.content
+
+        body = smart_text(content) if content else None
+        if body and 'json' in response.get('Content-Type', ''):
+            body = json.loads(body)
+
+        return dict(
+            status=response.status_code,
+            headers=dict(response.items()),
+            body=body,
+        )
+
+    def run_batch(self, request):
+        "phase processing all the sub requests of the batch"
+
+        try:
+            subs = self.parse_batch(request)
+        except ValueError as exc:
+            return HttpResponseBadRequest(smart_text(exc))
+
+        # group consecutive safe sub requests when running in parallel
+        # so that writes keep being applied in order...
+        groups = []
+        for sub in subs:
+            canGroup = (
+                self.parallel and groups and sub[0] in SAFE_METHODS
+                and groups[-1][0][0] in SAFE_METHODS
+            )
+            if canGroup:
+                groups[-1].append(sub)
+            else:
+                groups.append([sub])
+
+        responses = []
+        for group in groups:
+            if len(group) > 1:
+                pool = get_thread_pool(self.parallel)
+                responses.extend(pool.map(
+                    self.call_resource_in_thread,
+                    [(request,) + sub for sub in group]
+                ))
+            else:
+                responses.append(self.call_resource(request, *group[0]))
+
+        results = [self.encode_response(r) for r in responses]
+
+        return HttpResponse(
+            json.dumps(results), content_type='application/json'
+        )
@@ -15,6 +15,7 @@ from collections import Iterable
 
 from django import forms
 from django.conf import settings
+from django.utils import six
 
 class AddErrorMixin:
     """
@@ -34,9 +35,179 @@ class AddErrorMixin:
             cleaned_data.pop(fieldname, None)
 
 
+def load_mapped_fields(obj, fields):
+    """
+    if obj is a persistent sqlalchemy mapped instance, load those of fields
+    that are deferred columns or lazy relationships not loaded yet, using a
+    single query instead of one query per attribute access.
+    return True if obj is a mapped instance.
+    """
+
+    # sqlalchemy is an optional dependency
+    try:
+        from sqlalchemy import inspect
+        from sqlalchemy.exc import NoInspectionAvailable
+        from sqlalchemy.orm import (
+            ColumnProperty, RelationshipProperty, load_only, joinedload
+        )
+    except ImportError:
+        return False
+
+    try:
+        state = inspect(obj)
+    except NoInspectionAvailable:
+        return False
+    mapper = getattr(state, 'mapper', None)
+    if mapper is None:
+        return False
+
+    session = state.session
+    if session is None or not state.persistent:
+        return True
+
+    unloaded = state.unloaded.intersection(fields)
+    if not unloaded:
+        return True
+
+    cls = mapper.class_
+    columns = []
+    relations = []
+    for name in unloaded:
+        prop = mapper.attrs.get(name)
+        if isinstance(prop, ColumnProperty):
+            columns.append(getattr(cls, name))
+        elif isinstance(prop, RelationshipProperty):
+            relations.append(getattr(cls, name))
+
+    if not (columns or relations):
+        return True
+
+    try:
+        from sqlalchemy.orm import selectinload as collectionload
+    except ImportError:
+        # sqlalchemy < 1.2
+        from sqlalchemy.orm import subqueryload as collectionload
+
+    # only fetch missing columns, primary key is always included
+    options = [load_only(*(columns or [
+        getattr(cls, mapper.get_property_by_column(c).key)
+        for c in mapper.primary_key
+    ]))]
+
+    # scalar relationships are joined, collections are loaded by one extra
+    # query each so that rows are not multiplied
+    for r in relations:
+        if r.property.uselist:
+            options.append(collectionload(r))
+        else:
+            options.append(joinedload(r))
+
+    # existing instance gets its unloaded attributes populated
+    session.query(cls).options(*options).filter(*[
+        c == v for c, v in zip(mapper.primary_key, state.identity)
+    ]).all()
+    return True
+
+
+def _pk_names(mapper):
+    "return attribute names of mapper primary key"
+
+    return [mapper.get_property_by_column(c).key for c in mapper.primary_key]
+
+
+def _changed_rows(formset):
+    """
+    return [(cleaned data, existing)] for changed forms of formset, existing
+    being True for forms editing one of the formset initial rows
+    """
+
+    count = formset.initial_form_count()
+    rv = []
+    for i, f in enumerate(formset):
+        if f.has_changed() and f.cleaned_data:
+            data = f.cleaned_data
+            if i < count:
+                # primary key may only be in initial values
+                data = dict(f.initial, **data)
+            rv.append((data, i < count))
+    return rv
+
+
+def _split_rows(rowClass, rows):
+    """
+    return (inserts, updates, deletes) mappings for rows [(data, existing)]
+    of mapped rowClass, deletes holding primary key values
+    raise ValueError if an existing row misses its primary key
+    """
+
+    from sqlalchemy import inspect
+
+    mapper = inspect(rowClass)
+    columns = set(mapper.column_attrs.keys())
+    pkNames = _pk_names(mapper)
+
+    inserts, updates, deletes = [], [], []
+    for data, existing in rows:
+        mapping = dict((k, v) for k, v in data.items() if k in columns)
+        hasPk = all(mapping.get(k) is not None for k in pkNames)
+
+        if existing and not hasPk:
+            raise ValueError(
+                "%s row misses primary key %s" % (
+                    rowClass.__name__, ", ".join(pkNames)
+                )
+            )
+
+        if data.get('DELETE'):
+            if existing:
+                deletes.append([mapping[k] for k in pkNames])
+        elif existing:
+            updates.append(mapping)
+        else:
+            for k in pkNames:
+                mapping.pop(k, None)
+            inserts.append(mapping)
+
+    return inserts, updates, deletes
+
+
+def _bulk_rows(session, rowClass, inserts, updates, deletes):
+    """
+    write mappings returned by _split_rows with one statement per kind of
+    operation, return dict(inserted, updated, deleted)
+    """
+
+    from sqlalchemy import inspect, and_, or_
+
+    mapper = inspect(rowClass)
+
+    if updates:
+        session.bulk_update_mappings(mapper, updates)
+    if inserts:
+        session.bulk_insert_mappings(mapper, inserts)
+    if deletes:
+        pkAttrs = [getattr(rowClass, k) for k in _pk_names(mapper)]
+        if len(pkAttrs) == 1:
+            condition = pkAttrs[0].in_([values[0] for values in deletes])
+        else:
+            condition = or_(*[
+                and_(*[a == v for a, v in zip(pkAttrs, values)])
+                for values in deletes
+            ])
+        session.query(rowClass).filter(condition).delete(
+            synchronize_session=False
+        )
+
+    return dict(
+        inserted=len(inserts), updated=len(updates), deleted=len(deletes)
+    )
+
+
 class ObjForm(forms.Form, AddErrorMixin):
     """
     base Form that make it easier to work with non ORM object...
+    sqlalchemy mapped objects have the fields the form needs loaded in one
+    query, see load_mapped_fields.
     ---
     api is inspired by WTForm package
     """
@@ -67,6 +238,9 @@ class ObjForm(forms.Form, AddErrorMixin):
         obj = initialObj or dataObj
 
         if obj:
+            # sqlalchemy objects get their fields loaded in one query
+            load_mapped_fields(obj, self.base_fields.keys())
+
             for field in self.base_fields.keys():
                 value = getattr(obj, field, None)
                 if value is not None:
@@ -174,6 +348,130 @@ def fieldset_factory(fieldsets, prefix_init=None):
                             if callable(getattr(f, 'populate_obj', None)):
                                 f.populate_obj(obj, *attrs)
 
+        def collect_data(self, rows=()):
+            """
+            validate all fieldsets & formsets in a single pass, return
+            (objData, rowData) or None if form is not valid, where objData
+            merges cleaned data of fieldsets & formsets which prefix is not
+            in rows, and rowData maps formsets prefixes in rows to the list
+            of cleaned data of their changed forms.
+            """
+
+            isValid = True
+            objData = {}
+            rowData = {}
+            fs = self._fieldsets  # local alias
+            for pfx, form in self.items():
+                if pfx not in fs:
+                    continue
+
+                if callable(getattr(form, 'populate_obj', None)):
+                    isValid &= form.is_valid()
+                    if isValid:
+                        objData.update(form.cleaned_data)
+
+                elif isinstance(form, Iterable):
+                    # formset errors are computed once for all its forms
+                    isValid &= form.is_valid()
+                    if not isValid:
+                        continue
+                    if pfx in rows:
+                        rowData[pfx] = [
+                            f.cleaned_data for f in form
+                            if f.has_changed() and f.cleaned_data
+                        ]
+                    else:
+                        for f in form:
+                            objData.update(getattr(f, 'cleaned_data', {}))
+
+            self.__isValid = isValid
+            if isValid:
+                return objData, rowData
+
+        def bulk_save(self, obj, rows=None, session=None):
+            """
+            persist cleaned data with sqlalchemy bulk operations instead of
+            populating & flushing objects one at a time.
+
+            obj : sqlalchemy mapped instance, updated (or inserted if it is
+             transient) with the cleaned data of the fieldsets
+            rows : optional dict mapping formset prefix to the mapped class
+             of its rows or (mapped class, fk) where fk is the attribute key
+             (or tuple of keys for composite primary keys) referencing obj.
+             rows of the formset initial forms are updated, or deleted if
+             marked for deletion, others are inserted. Initial forms shall
+             have the primary key in their fields or initial values.
+            session : default to djam.sqlalchemy Session
+
+            return dict(inserted, updated, deleted) counts
+            raise ValueError if form is not valid or a row misses its key
+            """
+
+            from sqlalchemy import inspect
+            from sqlalchemy.orm.attributes import set_committed_value
+
+            if session is None:
+                from .sqlalchemy import Session as session
+
+            rows = rows or {}
+            collected = self.collect_data(rows)
+            if collected is None:
+                raise ValueError("%r is not valid" % self)
+            objData, rowData = collected
+
+            state = inspect(obj)
+            mapper = state.mapper
+
+            # rows are checked before anything is written
+            splits = {}
+            for pfx in rowData:
+                spec = rows[pfx]
+                rowClass, fk = spec if isinstance(spec, tuple) else (spec, None)
+                if fk:
+                    fk = (fk,) if isinstance(fk, six.string_types) else tuple(fk)
+                    if len(fk) != len(mapper.primary_key):
+                        raise ValueError(
+                            "%s does not match %s primary key" % (
+                                fk, mapper.class_.__name__
+                            )
+                        )
+                splits[pfx] = (rowClass, fk) + _split_rows(
+                    rowClass, _changed_rows(self[pfx])
+                )
+
+            counts = dict(inserted=0, updated=0, deleted=0)
+
+            columns = set(mapper.column_attrs.keys())
+            objData = dict(
+                (k, v) for k, v in objData.items() if k in columns
+            )
+
+            if state.identity is not None:
+                mapping = dict(zip(_pk_names(mapper), state.identity))
+                mapping.update(objData)
+                session.bulk_update_mappings(mapper, [mapping])
+                counts['updated'] += 1
+
+                # instance reflects database without being flushed again
+                for k, v in objData.items():
+                    set_committed_value(obj, k, v)
+            else:
+                for k, v in objData.items():
+                    setattr(obj, k, v)
+                session.bulk_save_objects([obj], return_defaults=True)
+                counts['inserted'] += 1
+
+            parentKey = mapper.primary_key_from_instance(obj)
+            for rowClass, fk, inserts, updates, deletes in splits.values():
+                if fk:
+                    for mapping in inserts + updates:
+                        mapping.update(zip(fk, parentKey))
+                done = _bulk_rows(session, rowClass, inserts, updates, deletes)
+                for k, n in done.items():
+                    counts[k] += n
+
+            return counts
+
         def __repr__(self):
             return "<FiedSetForm%s>" % str(tuple(self._fieldsets.keys()))
 
@@ -11,15 +11,26 @@
 from __future__ import unicode_literals
 
 import re
+import copy
+import time
 import string
+import hashlib
+import threading
+from collections import OrderedDict
 from email.mime.image import MIMEImage
 
 import django
+from django.conf import settings
 from django.template.loader import get_template
-from django.core.mail import EmailMessage, EmailMultiAlternatives
+from django.core.mail import (
+    EmailMessage, EmailMultiAlternatives, get_connection
+)
+from django.utils import six
 from django.utils.encoding import force_text, force_bytes
 from django.utils import translation
 
+from .utils import LRUCache
+
 # overcome deprecation of Context in django 1.8+
 if django.VERSION >= (1, 8, 0):
     Context = dict
@@ -35,6 +46,95 @@ class InlineImage(MIMEImage):
         MIMEImage.__init__(self, force_bytes(binary))
         self.add_header('Content-ID', "<{}>".format(name))
 
+class MimePartCache(LRUCache):
+    """
+    LRU cache of encoded MIME parts (attachments & inline images) keyed
+    by a hash of their name, mimetype & content, so that byte identical
+    parts are only encoded once.
+    Cached parts are bounded to maxBytes of encoded payload. Messages get
+    copies of them, hence changing a message part does not affect others.
+    """
+
+    def __init__(self, maxBytes):
+        super(MimePartCache, self).__init__(maxBytes=maxBytes)
+
+    @staticmethod
+    def key(*fields):
+        h = hashlib.sha1()
+        for f in fields:
+            h.update(force_bytes(f or ''))
+            h.update(b"\0")
+        return h.hexdigest()
+
+    @staticmethod
+    def sizeof(part):
+        "return length of part encoded payload"
+
+        payload = part.get_payload()
+        if isinstance(payload, list):
+            return sum(len(p.as_string()) for p in payload)
+        return len(payload)
+
+    def get(self, key):
+
+        part = super(MimePartCache, self).get(key)
+        if part is not None:
+            # encoded payload string is shared, headers are not
+            part = copy.deepcopy(part)
+        return part
+
+    def put(self, key, part):
+        super(MimePartCache, self).put(
+            key, copy.deepcopy(part), self.sizeof(part)
+        )
+
+
+_defaultPartCache = []
+_partCacheLock = threading.Lock()
+
+def get_part_cache():
+    """
+    return MimePartCache shared by EmailTemplates, which size is set by
+    EMAIL_PART_CACHE_BYTES setting (default 0 disables cache)
+    """
+
+    if not _defaultPartCache:
+        with _partCacheLock:
+            if not _defaultPartCache:
+                maxBytes = getattr(settings, 'EMAIL_PART_CACHE_BYTES', 0)
+                _defaultPartCache.append(MimePartCache(maxBytes) if maxBytes else None)
+    return _defaultPartCache[0]
+
+def encode_attachment(filename, content=None, mimetype=None):
+    "return MIME part of attachment, encoded as django EmailMessage does"
+
+    msg = EmailMessage()
+    msg.attach(filename, content, mimetype)
+    # last part of the multipart message follows the body part
+    return msg.message().get_payload()[-1]
+
+def _freeze(value):
+    "return hashable equivalent of render context value"
+
+    if isinstance(value, dict):
+        return tuple(sorted(
+            ((k, _freeze(v)) for k, v in value.items()), key=lambda i: i[0]
+        ))
+    if isinstance(value, (list, tuple)):
+        return tuple(_freeze(v) for v in value)
+    if isinstance(value, set):
+        return frozenset(value)
+    return value
+
+class RenderedPartsCache(LRUCache):
+    """
+    LRU cache of at most maxEntries rendered (subject, fromUser, text, html)
+    keyed on (language, subject, fromUser, render context).
+    """
+
+    def __init__(self, maxEntries=128):
+        super(RenderedPartsCache, self).__init__(maxEntries=maxEntries)
+
 class EmailTemplate(object):
     """
     A class that allows to construct multi-alternatives email with text part
@@ -63,6 +163,18 @@ class EmailTemplate(object):
     msg = WelcomeEmail(["user@example.com"],fname="test",lname="user")
     ...
     msg.send()
+
+    ...or for many recipients over one connection
+
+    results, summary = WelcomeEmail.send_many([
+        {'toAddresses': ["a@example.com"], 'fname': "A", 'lname': "User"},
+        {'toAddresses': ["b@example.com"], 'fname': "B", 'lname': "User"},
+    ])
+
+    ...or rendering messages lazily, grouped by recipient language
+
+    for toAddresses, msg, error in WelcomeEmail.iter_messages(recipients):
+        ...
     
     Parameters
     ----------
@@ -107,6 +219,19 @@ class EmailTemplate(object):
      callable allows templating inline image (eg barcode generation).
      They accept any number of keywords arguments and return (name, bytes)
      tuple.
+
+    partCache : optional MimePartCache
+     cache of encoded attachments & inline images, default to the cache
+     returned by get_part_cache() if EMAIL_PART_CACHE_BYTES is set, False
+     disables caching
+
+    renderCacheSize : optional int
+     when set, rendered subject, sender name, text & html parts are kept for
+     at most renderCacheSize distinct (language, render context), so that
+     messages which only differ by their envelope are rendered once, which
+     suits broadcast emails. Context values shall be hashable and not
+     change while the template is in use. renderedParts.stats() reports
+     cache efficiency.
     """
 
     STR_TPL_REGEX = re.compile(r"\$")
@@ -115,7 +240,8 @@ class EmailTemplate(object):
             self, subjectTpl, textTpl,
             htmlTpl=None, toAddresses=None, fromAddress=None,
             fromUser=None, replyToAddress=None, lang=None,
-            docAttachments=None, inlineImages=None):
+            docAttachments=None, inlineImages=None, partCache=None,
+            renderCacheSize=None):
 
         self.subjectTpl = subjectTpl  # expected to be ugettext_lazy processed...
         self.fromUser = fromUser  # expected to be ugettext_lazy processed...
@@ -149,6 +275,14 @@ class EmailTemplate(object):
 
         self.lang = lang  # freeze email language code, usefull for admin...
 
+        if partCache is None:
+            partCache = get_part_cache()
+        self.partCache = partCache or None
+
+        self.renderedParts = None
+        if renderCacheSize:
+            self.renderedParts = RenderedPartsCache(renderCacheSize)
+
     def render_param(self, paramTplString, cacheable, kwargs):
 
         if cacheable:
@@ -194,75 +328,327 @@ class EmailTemplate(object):
                     translation.activate(lang)
                     savedLang = curLang
 
-            # Render title
-            # if ugettext_lazy was used, this shall translate it
+            # if ugettext_lazy was used, this shall translate them
             subject = force_text(subject)
-            if self.STR_TPL_REGEX.search(subject):
-                subject = self.render_param(subject, cacheSubjectTpl, kwargs)
-
-            # Update fromAddress if fromUser is set
             if fromUser is not None:
-                # if ugettext_lazy was used, this shall translate it
                 fromUser = force_text(fromUser)
-                if self.STR_TPL_REGEX.search(fromUser):
-                    fromUser = self.render_param(
-                        fromUser, cacheFromUserTpl, kwargs
-                    )
-                fromAddress = "%s <%s>" % (fromUser, fromAddress)
-
-            # Instantiate template context
-            ctx = Context(kwargs)
-
-            # Render the plain text part
-            body = self.textTpl.render(ctx)
-
-            # prepare headers dict
-            hdrs = {}
-            if replyToAddress:
-                hdrs["Reply-To"] = replyToAddress
-            #
-            hdrs = hdrs or None
-
-            # Construct msg
-            msg = self.msg_factory(
-                subject=subject, body=body, from_email=fromAddress,
-                to=toAddresses, headers=hdrs
-            )
 
-            # Add html alternative
-            if self.htmlTpl:
-                htmlPart = self.htmlTpl.render(ctx)
-                msg.attach_alternative(htmlPart, "text/html")
-            
-            # add inline images
-            if self.inlineImages:
-                
-                if self.htmlTpl:
-                    msg.mixed_subtype = 'related'
-
-                for inline in self.inlineImages:
-
-                    if callable(inline):
-                        # inline callable shall return a 2-tuple containing
-                        # inline_name, inline_bytes
-                        inline = InlineImage(*inline(**kwargs))
-                    
-                    msg.attach(inline)
-
-            # add file attachments
-            # those shows as attached documents in msg...
-            if self.docAttachments:
-                for attachment in self.docAttachments:
-
-                    if callable(attachment):
-                        # attachment callable shall return a 3-tuple containing
-                        # attachment_name, attachment_bytes, attachment_mime_type
-                        attachment = attachment(**kwargs)
-                    
-                    msg.attach(*attachment)
-
-            return msg
+            return self.render_message(
+                toAddresses, fromAddress, fromUser, replyToAddress,
+                subject, cacheSubjectTpl, cacheFromUserTpl, kwargs
+            )
 
         finally:
             if savedLang:
                 translation.activate(savedLang)
+
+    def render_parts(self, subject, fromUser, cacheSubjectTpl,
+                     cacheFromUserTpl, kwargs):
+        "return rendered (subject, fromUser, text, html)"
+
+        # Render title
+        if self.STR_TPL_REGEX.search(subject):
+            subject = self.render_param(subject, cacheSubjectTpl, kwargs)
+
+        # Render sender name
+        if fromUser is not None and self.STR_TPL_REGEX.search(fromUser):
+            fromUser = self.render_param(fromUser, cacheFromUserTpl, kwargs)
+
+        # Instantiate template context
+        ctx = Context(kwargs)
+
+        # Render the plain text part
+        body = self.textTpl.render(ctx)
+
+        # Render html alternative
+        htmlPart = None
+        if self.htmlTpl:
+            htmlPart = self.htmlTpl.render(ctx)
+
+        return subject, fromUser, body, htmlPart
+
+    def render_key(self, subject, fromUser, kwargs):
+        """
+        return key of rendered parts in renderedParts cache,
+        None if render context can not be hashed
+        """
+
+        try:
+            key = (
+                translation.get_language(), subject, fromUser, _freeze(kwargs)
+            )
+            hash(key)
+        except TypeError:
+            return None
+        return key
+
+    def render_message(self, toAddresses, fromAddress, fromUser,
+                       replyToAddress, subject, cacheSubjectTpl,
+                       cacheFromUserTpl, kwargs):
+        """
+        return message rendered in current language
+        subject & fromUser are expected to be translated already
+        """
+
+        parts = key = None
+        if self.renderedParts is not None:
+            key = self.render_key(subject, fromUser, kwargs)
+            if key is not None:
+                parts = self.renderedParts.get(key)
+
+        if parts is None:
+            parts = self.render_parts(
+                subject, fromUser, cacheSubjectTpl, cacheFromUserTpl, kwargs
+            )
+            if key is not None:
+                self.renderedParts.put(key, parts)
+
+        subject, fromUser, body, htmlPart = parts
+
+        # Update fromAddress if fromUser is set
+        if fromUser is not None:
+            fromAddress = "%s <%s>" % (fromUser, fromAddress)
+
+        # prepare headers dict
+        hdrs = {}
+        if replyToAddress:
+            hdrs["Reply-To"] = replyToAddress
+        #
+        hdrs = hdrs or None
+
+        # Construct msg
+        msg = self.msg_factory(
+            subject=subject, body=body, from_email=fromAddress,
+            to=toAddresses, headers=hdrs
+        )
+
+        # Add html alternative
+        if htmlPart is not None:
+            msg.attach_alternative(htmlPart, "text/html")
+
+        # add inline images
+        if self.inlineImages:
+
+            if self.htmlTpl:
+                msg.mixed_subtype = 'related'
+
+            for inline in self.inlineImages:
+
+                if callable(inline):
+                    # inline callable shall return a 2-tuple containing
+                    # inline_name, inline_bytes
+                    inline = self.make_inline(*inline(**kwargs))
+                else:
+                    # preloaded inline shall not be shared by messages
+                    inline = copy.deepcopy(inline)
+
+                msg.attach(inline)
+
+        # add file attachments
+        # those shows as attached documents in msg...
+        if self.docAttachments:
+            for attachment in self.docAttachments:
+
+                if callable(attachment):
+                    # attachment callable shall return a 3-tuple containing
+                    # attachment_name, attachment_bytes, attachment_mime_type
+                    attachment = attachment(**kwargs)
+
+                self.attach(msg, *attachment)
+
+        return msg
+
+    def make_inline(self, name, binary):
+        "return InlineImage, reusing cached one if any"
+
+        cache = self.partCache  # local alias
+        if cache is None:
+            return InlineImage(name, binary)
+
+        key = cache.key('inline', name, binary)
+        inline = cache.get(key)
+        if inline is None:
+            inline = InlineImage(name, binary)
+            cache.put(key, inline)
+        return inline
+
+    def attach(self, msg, filename, content=None, mimetype=None):
+        "attach document to msg, reusing cached MIME part if any"
+
+        cache = self.partCache  # local alias
+        if cache is None:
+            return msg.attach(filename, content, mimetype)
+
+        key = cache.key('attachment', filename, mimetype, content)
+        part = cache.get(key)
+        if part is None:
+            part = encode_attachment(filename, content, mimetype)
+            cache.put(key, part)
+        msg.attach(part)
+
+    def _recipient_kwargs(self, recipient, kwargs):
+        "return __call__ keyword arguments for one send_many recipient"
+
+        if isinstance(recipient, dict):
+            params = dict(kwargs)
+            params.update(recipient)
+            return params
+
+        if isinstance(recipient, six.string_types):
+            recipient = [recipient]
+        return dict(kwargs, toAddresses=list(recipient))
+
+    def _render_group(self, group):
+        """
+        return list of (toAddresses, message, error) for group of
+        __call__ keyword arguments sharing current language
+        """
+
+        rendered = []
+
+        # default subject & sender translated once for the group
+        subjectTpl = force_text(self.subjectTpl) if self.subjectTpl else None
+        fromUserTpl = force_text(self.fromUser) if self.fromUser else None
+
+        for params in group:
+
+            toAddresses = params.pop('toAddresses', None) or self.toAddresses
+            try:
+                if not toAddresses:
+                    raise ValueError("missing destinaries toAddresses list")
+
+                fromAddress = params.pop('fromAddress', None) or self.fromAddress
+                if not fromAddress:
+                    raise ValueError("missing originator address")
+
+                subject = params.pop('subject', None)
+                cacheSubjectTpl = (subject is None)
+                subject = force_text(subject) if subject else subjectTpl
+                if not subject:
+                    raise ValueError("missing email subject")
+
+                fromUser = params.pop('fromUser', None)
+                cacheFromUserTpl = (fromUser is None)
+                fromUser = force_text(fromUser) if fromUser else fromUserTpl
+
+                replyToAddress = params.pop('replyToAddress', None) or \
+                    self.replyToAddress
+
+                msg = self.render_message(
+                    toAddresses, fromAddress, fromUser, replyToAddress,
+                    subject, cacheSubjectTpl, cacheFromUserTpl, params
+                )
+                rendered.append((toAddresses, msg, None))
+
+            except Exception as exc:
+                rendered.append((toAddresses, None, exc))
+
+        return rendered
+
+    def iter_messages(self, recipients, chunkSize=500, **kwargs):
+        """
+        generate (toAddresses, message, error) for every recipient, message
+        being None if it could not be rendered because of error.
+
+        recipients : iterable of email address, list of addresses or dict
+         of __call__ keyword arguments, completed by kwargs
+
+        Recipients are read by chunks of chunkSize, grouped by 'lang' so that
+        every language is activated once per chunk. Messages of a chunk are
+        yielded in language order once rendered, with language restored.
+        """
+
+        chunk = []
+        for recipient in recipients:
+            chunk.append(self._recipient_kwargs(recipient, kwargs))
+            if len(chunk) < chunkSize:
+                continue
+            for rv in self._render_chunk(chunk):
+                yield rv
+            chunk = []
+
+        if chunk:
+            for rv in self._render_chunk(chunk):
+                yield rv
+
+    def _render_chunk(self, chunk):
+        "return list of (toAddresses, message, error) for chunk"
+
+        groups = OrderedDict()
+        for params in chunk:
+            lang = params.pop('lang', None) or self.lang
+            groups.setdefault(lang, []).append(params)
+
+        curLang = translation.get_language()
+        rendered = []
+        try:
+            for lang, group in groups.items():
+                lang = lang or curLang
+                if lang != translation.get_language():
+                    translation.activate(lang)
+                rendered.extend(self._render_group(group))
+        finally:
+            if translation.get_language() != curLang:
+                translation.activate(curLang)
+
+        return rendered
+
+    def send_many(self, recipients, connection=None, batchSize=100,
+                  chunkSize=500, **kwargs):
+        """
+        render & send one message per recipient over a single connection,
+        which is reopened after every batchSize messages and after errors.
+        Messages are rendered by iter_messages.
+
+        recipients : iterable of email address, list of addresses or dict
+         of __call__ keyword arguments, completed by kwargs
+
+        return (results, summary) where results lists (toAddresses, error)
+        for every recipient, error being None if message was sent, and
+        summary dict(sent, failed, connections, elapsed, rate)
+        """
+
+        connection = connection or get_connection()
+
+        results = []
+        sent = failed = connections = 0
+        inBatch = 0
+        started = time.time()
+        try:
+            messages = self.iter_messages(recipients, chunkSize, **kwargs)
+            for toAddresses, msg, error in messages:
+
+                if error is None:
+                    try:
+                        if inBatch >= batchSize:
+                            connection.close()
+                            inBatch = 0
+                        if inBatch == 0:
+                            connection.open()
+                            connections += 1
+
+                        inBatch += 1
+                        if not connection.send_messages([msg]):
+                            raise IOError("message was not sent")
+
+                    except Exception as exc:
+                        error = exc
+
+                        # connection state is unknown, start a new one
+                        if inBatch:
+                            connection.close()
+                            inBatch = 0
+
+                if error is None:
+                    sent += 1
+                else:
+                    failed += 1
+                results.append((toAddresses, error))
+        finally:
+            connection.close()
+
+        elapsed = time.time() - started
+        return results, dict(
+            sent=sent, failed=failed, connections=connections,
+            elapsed=elapsed, rate=(sent / elapsed) if elapsed else None
+        )
@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.management.commands.outbox_worker
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Deliver messages spooled in djam.outbox by a pool of worker processes.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals
+
+import time, signal
+from multiprocessing import Process
+
+from django.core.management.base import BaseCommand
+
+from djam.outbox import get_outbox, deliver
+
+
+def _work(path, options):
+    "worker process loop"
+
+    # parent process handles interruption
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+    outbox = get_outbox(path)
+    while True:
+        counts = deliver(
+            outbox,
+            maxAttempts=options['max_attempts'],
+            retryDelay=options['retry_delay'],
+            maxRetryDelay=options['max_retry_delay'],
+            limit=options['batch'],
+        )
+        if options['once'] and not any(counts.values()):
+            return
+        if not any(counts.values()):
+            time.sleep(options['interval'])
+
+
+class Command(BaseCommand):
+
+    help = "Deliver messages spooled by djam.outbox.SpoolEmailBackend, " \
+           "retrying failed deliveries with exponential backoff."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            '--outbox', default=None,
+            help="spool directory, default is OUTBOX_DIR setting"
+        )
+        parser.add_argument(
+            '--processes', type=int, default=1,
+            help="number of delivery processes"
+        )
+        parser.add_argument(
+            '--once', action='store_true', default=False,
+            help="exit once no message is due instead of polling"
+        )
+        parser.add_argument(
+            '--interval', type=float, default=5,
+            help="seconds in between polls of an empty outbox"
+        )
+        parser.add_argument(
+            '--batch', type=int, default=100,
+            help="messages delivered per connection"
+        )
+        parser.add_argument(
+            '--max-attempts', type=int, default=None,
+            help="overwrites OUTBOX_MAX_ATTEMPTS setting"
+        )
+        parser.add_argument(
+            '--retry-delay', type=float, default=None,
+            help="overwrites OUTBOX_RETRY_DELAY setting"
+        )
+        parser.add_argument(
+            '--max-retry-delay', type=float, default=None,
+            help="overwrites OUTBOX_MAX_RETRY_DELAY setting"
+        )
+        parser.add_argument(
+            '--recover-after', type=float, default=600,
+            help="requeue messages claimed by dead workers for that long"
+        )
+
+    def handle(self, *args, **options):
+
+        outbox = get_outbox(options['outbox'])
+
+        recovered = outbox.recover(options['recover_after'])
+        if recovered:
+            self.stdout.write("%i stale messages requeued" % recovered)
+
+        workers = [
+            Process(target=_work, args=(outbox.path, options))
+            for i in range(max(1, options['processes']))
+        ]
+        for w in workers:
+            w.start()
+        try:
+            for w in workers:
+                w.join()
+        except KeyboardInterrupt:
+            for w in workers:
+                w.terminate()
+                w.join()
+
+        if options.get('verbosity', 1):
+            stats = outbox.stats()
+            self.stdout.write(
+                "%(queue)i queued, %(active)i active, %(failed)i failed" % stats
+            )
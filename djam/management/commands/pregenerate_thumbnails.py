@@ -0,0 +1,167 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.management.commands.pregenerate_thumbnails
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+
+    Render thumbnails for all the master images found under a storage prefix,
+    so that Thumbnailer view finds them later without rendering.
+
+    Sizes to be rendered are taken from setting THUMBNAIL_PRESETS, a list of
+    (width, height) tuples or widths, or from the --size options.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals
+
+import time
+from multiprocessing import Pool, cpu_count
+
+from django.conf import settings
+from django.core.files.base import ContentFile
+from django.core.files.storage import default_storage
+from django.core.management.base import BaseCommand, CommandError
+
+from djam.thumbnailer import (
+    decode_master, encode_thumbnail, build_thumbnail_path,
+    parse_thumbnail_infos, parse_size
+)
+
+
+def walk_storage(storage, path):
+    "yield names of all the files stored below path"
+
+    dirs, files = storage.listdir(path)
+    prefix = "%s/" % path.rstrip('/') if path else ''
+    for f in files:
+        yield prefix + f
+    for d in dirs:
+        for f in walk_storage(storage, prefix + d):
+            yield f
+
+
+def _pregenerate(job):
+    "render & save thumbnails of one master, runs in pool process"
+
+    mastername, save_as, thumbs = job
+    try:
+        # decode master once with enough resolution for all the sizes
+        sizes = [size for thumbpath, size in thumbs]
+        decodeSize = (max(w for w, h in sizes), max(h for w, h in sizes))
+        picture, scale, fmt = decode_master(
+            default_storage.open(mastername), decodeSize
+        )
+        for thumbpath, size in thumbs:
+            content = encode_thumbnail(picture, size, save_as)
+            default_storage.save(thumbpath, ContentFile(content))
+        return mastername, len(thumbs), None
+    except Exception as exc:
+        return mastername, 0, "%s: %s" % (exc.__class__.__name__, exc)
+
+
+class Command(BaseCommand):
+
+    help = "Render thumbnails of configured sizes for every master image " \
+           "found below prefix. Existing thumbnails are skipped so that an " \
+           "interrupted run can be resumed."
+
+    def add_arguments(self, parser):
+
+        parser.add_argument(
+            'prefix', nargs='?', default='',
+            help="storage folder to walk, default is storage root"
+        )
+        parser.add_argument(
+            '--size', action='append', dest='sizes', default=[],
+            help="thumbnail size as WIDTHxHEIGHT or WIDTH, may be repeated. "
+                 "Overwrites THUMBNAIL_PRESETS setting."
+        )
+        parser.add_argument(
+            '--extensions', default='jpg,jpeg,png,gif',
+            help="comma separated extensions of master images"
+        )
+        parser.add_argument(
+            '--processes', type=int, default=cpu_count(),
+            help="number of rendering processes"
+        )
+
+    def get_sizes(self, options):
+        "return list of (width, height)"
+
+        presets = options['sizes'] or getattr(settings, 'THUMBNAIL_PRESETS', [])
+        sizes = []
+        try:
+            for p in presets:
+                sizes.append(parse_size(p))
+        except ValueError:
+            raise CommandError("invalid thumbnail size %s" % (p,))
+
+        if not sizes:
+            raise CommandError(
+                "no sizes, use --size or set THUMBNAIL_PRESETS setting"
+            )
+        return sizes
+
+    def handle(self, *args, **options):
+
+        storage = default_storage
+        sizes = self.get_sizes(options)
+        extensions = set(
+            e.strip().lower() for e in options['extensions'].split(',')
+        )
+        verbosity = options.get('verbosity', 1)
+
+        # collect work, skipping outputs that already exist
+        jobs = []
+        skipped = 0
+        for name in walk_storage(storage, options['prefix']):
+
+            ext = name.rsplit('.', 1)[-1]
+            if ext.lower() not in extensions:
+                continue
+
+            # ignore thumbnails & masters Thumbnailer can not address
+            if parse_thumbnail_infos(name) is not None:
+                continue
+            thumbs = [(build_thumbnail_path(name, w, h), (w, h)) for w, h in sizes]
+            rv = parse_thumbnail_infos(thumbs[0][0])
+            if rv is None or rv[0] != name:
+                continue
+
+            todo = [t for t in thumbs if not storage.exists(t[0])]
+            skipped += len(thumbs) - len(todo)
+            if todo:
+                save_as = "JPEG" if ext == "jpg" else ext
+                jobs.append((name, save_as, todo))
+
+        self.stdout.write(
+            "%i masters to process, %i existing thumbnails skipped" %
+            (len(jobs), skipped)
+        )
+        if not jobs:
+            return
+
+        started = time.time()
+        rendered = failed = 0
+        pool = Pool(max(1, options['processes']))
+        try:
+            results = pool.imap_unordered(_pregenerate, jobs)
+            for n, (mastername, count, error) in enumerate(results, 1):
+                rendered += count
+                if error is not None:
+                    failed += 1
+                    self.stderr.write("%s failed : %s" % (mastername, error))
+                elif verbosity > 1:
+                    self.stdout.write("%s : %i thumbnails" % (mastername, count))
+                if verbosity and (n % 100 == 0 or n == len(jobs)):
+                    elapsed = time.time() - started
+                    self.stdout.write(
+                        "[%i/%i] %i thumbnails rendered in %.1fs (%.1f/s)" %
+                        (n, len(jobs), rendered, elapsed,
+                         rendered / elapsed if elapsed else 0)
+                    )
+        finally:
+            pool.close()
+            pool.join()
+
+        if failed:
+            raise CommandError("%i masters could not be processed" % failed)
@@ -0,0 +1,327 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.outbox
+    ~~~~~~~~~~~
+
+    Durable local outbox : an email backend that spools messages in a
+    directory and returns immediately, messages being later delivered by
+    the outbox_worker management command, eg :
+
+        EMAIL_BACKEND = 'djam.outbox.SpoolEmailBackend'
+        OUTBOX_DIR = '/var/spool/myapp/outbox'
+
+    Settings :
+        * OUTBOX_DIR : spool directory, required
+        * OUTBOX_BACKEND : backend delivering messages, default is smtp
+        * OUTBOX_MAX_ATTEMPTS : delivery attempts before giving up, default 8
+        * OUTBOX_RETRY_DELAY : seconds before first retry, default 60, it
+          doubles after every failed attempt
+        * OUTBOX_MAX_RETRY_DELAY : upper bound of retry delay, default 3600
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import
+
+import os, json, time, uuid, random, smtplib, logging
+
+from django.conf import settings
+from django.core.mail import get_connection
+from django.core.mail.backends.base import BaseEmailBackend
+from django.core.exceptions import ImproperlyConfigured
+from django.utils.encoding import force_bytes, force_text
+
+__all__ = ['Outbox', 'SpoolEmailBackend', 'SpooledMessage', 'deliver']
+
+logger = logging.getLogger(__name__)
+
+
+class SpooledMessage(object):
+    """
+    Already encoded message, that django email backends can send as they
+    would send an EmailMessage.
+    """
+
+    encoding = None
+
+    class _Raw(object):
+        def __init__(self, raw):
+            self.raw = raw
+
+        def as_bytes(self, *args, **kwargs):
+            return self.raw
+
+        as_string = as_bytes
+
+    def __init__(self, from_email, to, raw):
+        self.from_email = from_email
+        self.to = to
+        self.raw = raw
+
+    def recipients(self):
+        return self.to
+
+    def message(self):
+        return self._Raw(self.raw)
+
+
+class Outbox(object):
+    """
+    Spool directory holding one file per message.
+
+    Files are written in tmp/ then renamed in queue/, their name starting
+    with the time of their next delivery attempt. Workers claim a message
+    renaming it in active/, which fails for all but one of them. Messages
+    that can not be delivered end up in failed/.
+
+    A file holds a JSON line of envelope & delivery state followed by the
+    encoded message.
+    """
+
+    DIRS = ('tmp', 'queue', 'active', 'failed')
+
+    def __init__(self, path):
+        self.path = path
+        for d in self.DIRS:
+            d = os.path.join(path, d)
+            if not os.path.isdir(d):
+                try:
+                    os.makedirs(d)
+                except OSError:
+                    # created concurrently
+                    if not os.path.isdir(d):
+                        raise
+
+    def _path(self, state, name):
+        return os.path.join(self.path, state, name)
+
+    def _write(self, state, meta, raw):
+        "atomically write message file in state folder, return its name"
+
+        name = "%013i-%s.msg" % (int(meta['due'] * 1000), uuid.uuid4().hex)
+        tmp = self._path('tmp', name)
+        with open(tmp, 'wb') as f:
+            f.write(force_bytes(json.dumps(meta)))
+            f.write(b"\n")
+            f.write(raw)
+            f.flush()
+            os.fsync(f.fileno())
+        os.rename(tmp, self._path(state, name))
+        return name
+
+    def put(self, message):
+        "spool django EmailMessage, return its name"
+
+        # encoding now fixes Message-ID & Date of all delivery attempts
+        raw = message.message().as_bytes(linesep='\r\n')
+        meta = dict(
+            sender=message.from_email, recipients=message.recipients(),
+            attempts=0, due=time.time(), error=None,
+        )
+        return self._write('queue', meta, raw)
+
+    def read(self, state, name):
+        "return (meta, SpooledMessage)"
+
+        with open(self._path(state, name), 'rb') as f:
+            meta = json.loads(force_text(f.readline()))
+            raw = f.read()
+        return meta, SpooledMessage(meta['sender'], meta['recipients'], raw)
+
+    def due(self, now=None):
+        "return names of queued messages due for delivery, oldest first"
+
+        now = int(1000 * (now or time.time()))
+        due = []
+        for name in sorted(os.listdir(os.path.join(self.path, 'queue'))):
+            if int(name.split('-', 1)[0]) > now:
+                break
+            due.append(name)
+        return due
+
+    def claim(self, name):
+        "return True if message name was claimed for delivery"
+
+        try:
+            os.rename(self._path('queue', name), self._path('active', name))
+        except OSError:
+            # claimed by another worker
+            return False
+
+        # recover relies on claim time
+        os.utime(self._path('active', name), None)
+        return True
+
+    def done(self, name):
+        os.unlink(self._path('active', name))
+
+    def retry(self, name, meta, message, error, delay):
+        "requeue claimed message for delivery in delay seconds"
+
+        meta = dict(meta, due=time.time() + delay, error=error)
+        self._write('queue', meta, message.raw)
+        os.unlink(self._path('active', name))
+
+    def fail(self, name, meta, message, error):
+        "move claimed message to failed folder"
+
+        meta = dict(meta, error=error)
+        self._write('failed', meta, message.raw)
+        os.unlink(self._path('active', name))
+
+    def quarantine(self, name):
+        "move unreadable claimed message file as is to failed folder"
+
+        os.rename(self._path('active', name), self._path('failed', name))
+
+    def recover(self, olderThan=600):
+        """
+        requeue messages claimed more than olderThan seconds ago, by a
+        worker that died while delivering them.
+        """
+
+        limit = time.time() - olderThan
+        recovered = 0
+        for name in os.listdir(os.path.join(self.path, 'active')):
+            path = self._path('active', name)
+            try:
+                if os.stat(path).st_mtime < limit:
+                    os.rename(path, self._path('queue', name))
+                    recovered += 1
+            except OSError:
+                pass
+        return recovered
+
+    def stats(self):
+        return dict(
+            (d, len(os.listdir(os.path.join(self.path, d))))
+            for d in self.DIRS[1:]
+        )
+
+
+def get_outbox(path=None):
+    path = path or getattr(settings, 'OUTBOX_DIR', None)
+    if not path:
+        raise ImproperlyConfigured("OUTBOX_DIR setting is not set")
+    return Outbox(path)
+
+
+class SpoolEmailBackend(BaseEmailBackend):
+    "Email backend that spools messages in the Outbox"
+
+    def __init__(self, outboxDir=None, fail_silently=False, **kwargs):
+        super(SpoolEmailBackend, self).__init__(fail_silently=fail_silently)
+        self.outbox = get_outbox(outboxDir)
+
+    def send_messages(self, email_messages):
+
+        count = 0
+        for message in email_messages:
+            if not message.recipients():
+                continue
+            try:
+                self.outbox.put(message)
+                count += 1
+            except Exception:
+                if not self.fail_silently:
+                    raise
+        return count
+
+
+def is_permanent(exc):
+    "return True if delivery error shall not be retried"
+
+    if isinstance(exc, smtplib.SMTPRecipientsRefused):
+        codes = [code for code, msg in exc.recipients.values()]
+        return bool(codes) and all(code >= 500 for code in codes)
+    code = getattr(exc, 'smtp_code', None)
+    return code is not None and code >= 500
+
+
+def _close(connection):
+    "close connection which state maybe broken"
+
+    try:
+        connection.close()
+    except Exception:
+        pass
+
+
+def deliver(outbox, connection=None, maxAttempts=None, retryDelay=None,
+            maxRetryDelay=None, limit=None):
+    """
+    deliver due messages of outbox, return dict(sent, retried, failed)
+    messages which delivery failed are retried with exponential backoff.
+    """
+
+    if maxAttempts is None:
+        maxAttempts = getattr(settings, 'OUTBOX_MAX_ATTEMPTS', 8)
+    if retryDelay is None:
+        retryDelay = getattr(settings, 'OUTBOX_RETRY_DELAY', 60)
+    if maxRetryDelay is None:
+        maxRetryDelay = getattr(settings, 'OUTBOX_MAX_RETRY_DELAY', 3600)
+
+    connection = connection or get_connection(getattr(
+        settings, 'OUTBOX_BACKEND', 'django.core.mail.backends.smtp.EmailBackend'
+    ))
+    if isinstance(connection, SpoolEmailBackend):
+        # messages would be spooled again instead of being delivered
+        raise ImproperlyConfigured(
+            "OUTBOX_BACKEND shall not be djam.outbox.SpoolEmailBackend"
+        )
+
+    counts = dict(sent=0, retried=0, failed=0)
+    opened = False
+    try:
+        for name in outbox.due():
+
+            if limit is not None and sum(counts.values()) >= limit:
+                break
+            if not outbox.claim(name):
+                continue
+
+            try:
+                meta, message = outbox.read('active', name)
+            except Exception as exc:
+                logger.error("can not read spooled %s : %s", name, exc)
+                outbox.quarantine(name)
+                counts['failed'] += 1
+                continue
+
+            try:
+                if not opened:
+                    connection.open()
+                    opened = True
+                connection.send_messages([message])
+
+            except Exception as exc:
+                attempts = meta['attempts'] + 1
+                meta['attempts'] = attempts
+                error = "%s: %s" % (exc.__class__.__name__, exc)
+
+                if attempts >= maxAttempts or is_permanent(exc):
+                    logger.error("giving up delivery of %s : %s", name, error)
+                    outbox.fail(name, meta, message, error)
+                    counts['failed'] += 1
+                else:
+                    # jitter spreads retries of messages that failed together
+                    delay = min(maxRetryDelay, retryDelay * 2 ** (attempts - 1))
+                    delay *= random.uniform(0.8, 1.2)
+                    logger.warning(
+                        "delivery of %s failed, retry in %is : %s",
+                        name, delay, error
+                    )
+                    outbox.retry(name, meta, message, error, delay)
+                    counts['retried'] += 1
+
+                # connection state is unknown
+                if opened:
+                    _close(connection)
+                    opened = False
+            else:
+                outbox.done(name)
+                counts['sent'] += 1
+    finally:
+        if opened:
+            _close(connection)
+
+    return counts
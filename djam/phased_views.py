@@ -10,15 +10,25 @@
 """
 from __future__ import unicode_literals
 
-import re, json
-
-from django.http.response import HttpResponseBase
+import re, json, calendar
+
+from django.core.files.uploadhandler import TemporaryFileUploadHandler
+from django.http import QueryDict
+from django.http.multipartparser import MultiPartParser
+from django.http.response import (
+    HttpResponse, HttpResponseBase, HttpResponseNotModified
+)
 from django.views.generic import View
 from django.views.decorators.csrf import csrf_exempt
 from django.utils.decorators import method_decorator
 from django.utils.encoding import smart_text
+from django.utils.http import quote_etag, http_date
 from django.utils import six
 
+from .uploads import SizeLimitUploadHandler, UploadTooLarge
+from .utils import is_not_modified
+
+
 class PhasedRequestProcessingMeta(type):
     """
     Metaclass that :
@@ -125,38 +135,142 @@ class BaseApiResource(six.with_metaclass(PhasedRequestProcessingMeta, View)):
     """
 
     @method_decorator(csrf_exempt)
-    def dispatch(self, *args, **kwargs):
-        return super(BaseApiResource, self).dispatch(*args, **kwargs)
+    def dispatch(self, request, *args, **kwargs):
+        resp = super(BaseApiResource, self).dispatch(request, *args, **kwargs)
+        return self.finalize_response(request, resp)
+
+    def finalize_response(self, request, response):
+        """
+        give phases a chance to post process the response...
+        Phases that need to act on the response mark the request, and
+        subclasses extending this method shall always call super.
+        """
+
+        # add validators recorded by check_conditional
+        validators = getattr(request, 'conditional_validators', None)
+        if validators and getattr(response, 'status_code', None) == 200:
+            etag, lastModified = validators
+            if etag is not None and not response.has_header('ETag'):
+                response['ETag'] = etag
+            if lastModified is not None and \
+                    not response.has_header('Last-Modified'):
+                response['Last-Modified'] = http_date(lastModified)
+
+        return response
+
+    def get_etag(self, request):
+        """
+        return cheap unquoted validator (version, hash...) for requested
+        resource or None. Shall be overwritten to activate check_conditional phase...
+        """
+        return None
+
+    def get_last_modified(self, request):
+        """
+        return last modification time of requested resource as a datetime
+        or a timestamp or None.
+        Shall be overwritten to activate check_conditional phase...
+        """
+        return None
+
+    def check_conditional(self, request):
+        """
+        phase returning 304 if client copy of resource is still valid
+        ---
+        It shall be listed before the expensive phases, eg :
+            GET_PHASES = ['check_conditional', 'load_obj', 'render']
+        """
+
+        if request.method not in ('GET', 'HEAD'):
+            return
+
+        etag = self.get_etag(request)
+        if etag is not None:
+            etag = quote_etag(smart_text(etag))
+
+        lastModified = self.get_last_modified(request)
+        if lastModified is not None:
+            if hasattr(lastModified, 'utctimetuple'):
+                lastModified = calendar.timegm(lastModified.utctimetuple())
+            lastModified = int(lastModified)
+
+        if etag is None and lastModified is None:
+            return
+
+        # mark request so that validators are later added to response
+        request.conditional_validators = (etag, lastModified)
+
+        if is_not_modified(request, etag, lastModified):
+            resp = HttpResponseNotModified()
+            if etag is not None:
+                resp['ETag'] = etag
+            if lastModified is not None:
+                resp['Last-Modified'] = http_date(lastModified)
+            return resp
 
     _is_json = staticmethod(re.compile('/json').search)
 
+    # maximum size in bytes of request body, None means no limit
+    maxUploadSize = None
+
+    def get_upload_handlers(self, request):
+        """
+        return upload handlers used to parse multipart body.
+        Default handlers stream uploaded files to temporary files...
+        """
+
+        handlers = [TemporaryFileUploadHandler(request)]
+        if self.maxUploadSize is not None:
+            handlers.insert(0, SizeLimitUploadHandler(self.maxUploadSize, request))
+        return handlers
+
     def load_body(self, request):
         """
         deserialize request.body in request.POST & request.FILES
+        returns 413 response if body exceeds maxUploadSize
         """
 
-        if not (request.POST or request.FILES):
+        contenttype = request.META.get("CONTENT_TYPE","")
+
+        # reject announced oversized body before reading it
+        if self.maxUploadSize is not None:
+            try:
+                length = int(request.META.get('CONTENT_LENGTH') or 0)
+            except ValueError:
+                length = 0
+            if length > self.maxUploadSize:
+                return HttpResponse(status=413)
+
+        isMultipart = contenttype.startswith('multipart/')
+        if isMultipart and not hasattr(request, '_files'):
+            request.upload_handlers = self.get_upload_handlers(request)
 
-            contenttype = request.META.get("CONTENT_TYPE","")
-            
-            if self._is_json(contenttype):
+        try:
 
-                request.POST = json.loads(smart_text(request.body))
+            if not (request.POST or request.FILES):
 
-            elif request.method != 'POST':
+                if self._is_json(contenttype):
 
-                # save actual method (eg PUT...)
-                method = request.method
+                    request.POST = json.loads(smart_text(request.body))
 
-                try:
+                elif request.method != 'POST':
 
-                    # trick Django in believing this is a POST
-                    request.method = 'POST'
-                    request._load_post_and_files()
+                    # Django only parses POST body, parse it directly
+                    # without altering request.method...
+                    if isMultipart:
+                        parser = MultiPartParser(
+                            request.META, request, request.upload_handlers,
+                            request.encoding
+                        )
+                        request._post, request._files = parser.parse()
 
-                finally:
+                    elif contenttype.startswith(
+                            'application/x-www-form-urlencoded'):
+                        request._post = QueryDict(
+                            request.body, encoding=request.encoding
+                        )
 
-                    # restore method
-                    request.method = method
+        except UploadTooLarge:
+            return HttpResponse(status=413)
 
     load_json = load_body
@@ -0,0 +1,317 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.ratelimit
+    ~~~~~~~~~~~~~~
+
+    Admission control for BaseApiResource : per key token buckets limiting
+    request rate and per key counters limiting concurrent requests.
+
+    Buckets live either in a django cache or in a shared memory segment that
+    all the workers running on the host map. This can be configured using
+    settings :
+        * RATELIMIT_SHM_PATH : path of the file backing the shared memory
+          segment, if not set the django cache is used.
+        * RATELIMIT_SHM_SLOTS : number of buckets in the segment, default 8192
+        * RATELIMIT_CACHE : name of the django cache, default is 'default'
+        * RATELIMIT_CONCURRENCY_TTL : seconds after which concurrency slots
+          leaked by killed workers are reclaimed, default 300. It shall
+          exceed the duration of the longest request.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import, division
+
+import os, time, math, mmap, struct, hashlib, threading
+
+from django.conf import settings
+from django.core.cache import caches
+from django.http import HttpResponse
+from django.utils.decorators import method_decorator
+from django.utils.encoding import force_bytes
+from django.views.decorators.csrf import csrf_exempt
+
+__all__ = [
+    'RateLimitMixin', 'CacheBucketStore', 'SharedMemoryBucketStore',
+    'get_default_store'
+]
+
+
+class CacheBucketStore(object):
+    """
+    Keep buckets in a django cache.
+    Bucket updates are not atomic, under contention a few extra requests may
+    be admitted. Concurrency counters rely on atomic cache incr/decr, they
+    expire concurrencyTtl seconds after their creation.
+    """
+
+    keyPrefix = "djam.ratelimit"
+
+    def __init__(self, alias='default', concurrencyTtl=300):
+        self.cache = caches[alias]
+        self.concurrencyTtl = concurrencyTtl
+
+    def consume(self, key, rate, burst):
+        """
+        take one token in bucket key refilled at rate tokens per second.
+        return 0 if token was available or seconds to wait before retrying.
+        """
+
+        k = "%s.rate.%s" % (self.keyPrefix, key)
+        now = time.time()
+        tokens, stamp = self.cache.get(k) or (burst, now)
+        tokens = min(burst, tokens + (now - stamp) * rate)
+
+        if tokens >= 1:
+            wait = 0
+            tokens -= 1
+        else:
+            wait = (1 - tokens) / rate
+
+        # bucket is full again after burst / rate seconds
+        self.cache.set(k, (tokens, now), int(math.ceil(burst / rate)) + 1)
+        return wait
+
+    def acquire(self, key, limit):
+        "return True if one of the limit concurrency slots of key was taken"
+
+        k = "%s.conc.%s" % (self.keyPrefix, key)
+        # slots leaked by killed workers are reclaimed when counter expires
+        self.cache.add(k, 0, self.concurrencyTtl)
+        try:
+            n = self.cache.incr(k)
+        except ValueError:
+            # key expired in between add & incr
+            self.cache.add(k, 1, self.concurrencyTtl)
+            n = 1
+        if n > limit:
+            self.cache.decr(k)
+            return False
+        return True
+
+    def release(self, key):
+
+        k = "%s.conc.%s" % (self.keyPrefix, key)
+        try:
+            self.cache.decr(k)
+        except ValueError:
+            pass
+
+
+class SharedMemoryBucketStore(object):
+    """
+    Keep buckets in a memory mapped file shared by all workers on the host.
+    Each key is hashed to one slot, locked using fcntl byte range lock while
+    it is updated. Keys which collide on a slot evict each other, hence the
+    number of slots shall largely exceed the number of active keys.
+    Concurrent requests count is reset if it was not updated for
+    concurrencyTtl seconds, reclaiming slots leaked by killed workers.
+    (Unix only)
+    """
+
+    # key hash, tokens, last refill time, concurrent requests,
+    # last update time of concurrent requests
+    _slot = struct.Struct(str("<Qddqd"))
+
+    def __init__(self, path, slots=8192, concurrencyTtl=300):
+
+        import fcntl
+        self._lockf = fcntl.lockf
+        self._LOCK_EX = fcntl.LOCK_EX
+        self._LOCK_UN = fcntl.LOCK_UN
+
+        self.slots = slots
+        self.concurrencyTtl = concurrencyTtl
+        size = slots * self._slot.size
+
+        fd = os.open(path, os.O_RDWR | os.O_CREAT, 0o600)
+        if os.fstat(fd).st_size < size:
+            os.ftruncate(fd, size)
+        self._fd = fd
+        self._map = mmap.mmap(fd, size)
+
+        # fcntl locks are owned by process, threads need their own lock
+        self._tLock = threading.Lock()
+
+    def _locate(self, key):
+        h = struct.unpack(str("<Q"), hashlib.sha1(force_bytes(key)).digest()[:8])[0]
+        return h, (h % self.slots) * self._slot.size
+
+    def _update(self, key, func):
+        "apply func to slot of key under lock, return func result"
+
+        h, offset = self._locate(key)
+        size = self._slot.size
+        with self._tLock:
+            self._lockf(self._fd, self._LOCK_EX, size, offset)
+            try:
+                slot = self._slot.unpack_from(self._map, offset)
+                if slot[0] != h:
+                    # free or evicted slot
+                    slot = (h, -1.0, 0.0, 0, 0.0)
+                rv, slot = func(slot)
+                self._slot.pack_into(self._map, offset, *slot)
+                return rv
+            finally:
+                self._lockf(self._fd, self._LOCK_UN, size, offset)
+
+    def consume(self, key, rate, burst):
+
+        def take(slot):
+            h, tokens, stamp, count, used = slot
+            now = time.time()
+            if tokens < 0:
+                tokens = burst
+            else:
+                tokens = min(burst, tokens + (now - stamp) * rate)
+            if tokens >= 1:
+                return 0, (h, tokens - 1, now, count, used)
+            return (1 - tokens) / rate, (h, tokens, now, count, used)
+
+        return self._update(key, take)
+
+    def acquire(self, key, limit):
+
+        def incr(slot):
+            h, tokens, stamp, count, used = slot
+            now = time.time()
+            if now - used > self.concurrencyTtl:
+                count = 0
+            if count >= limit:
+                return False, slot
+            return True, (h, tokens, stamp, count + 1, now)
+
+        return self._update(key, incr)
+
+    def release(self, key):
+
+        def decr(slot):
+            h, tokens, stamp, count, used = slot
+            return None, (h, tokens, stamp, max(0, count - 1), time.time())
+
+        self._update(key, decr)
+
+
+_defaultStore = []
+_storeLock = threading.Lock()
+
+def get_default_store():
+    "return bucket store configured in settings"
+
+    if not _defaultStore:
+        with _storeLock:
+            if not _defaultStore:
+                ttl = getattr(settings, 'RATELIMIT_CONCURRENCY_TTL', 300)
+                path = getattr(settings, 'RATELIMIT_SHM_PATH', None)
+                if path:
+                    slots = getattr(settings, 'RATELIMIT_SHM_SLOTS', 8192)
+                    store = SharedMemoryBucketStore(path, slots, ttl)
+                else:
+                    alias = getattr(settings, 'RATELIMIT_CACHE', 'default')
+                    store = CacheBucketStore(alias, ttl)
+                _defaultStore.append(store)
+    return _defaultStore[0]
+
+
+class RateLimitMixin(object):
+    """
+    BaseApiResource mixin providing the check_rate_limit phase, that rejects
+    over limit requests with a 429 response. Mixin shall come first in the
+    bases list and the phase listed before any expensive phase, eg :
+
+        class Search(RateLimitMixin, BaseApiResource):
+
+            rateLimit = (20, 60)  # 20 requests per minute...
+            concurrencyLimit = 2
+            rateLimitKey = 'user'
+
+            GET_PHASES = ['check_rate_limit', 'search', 'render']
+    """
+
+    # (number of requests, period in seconds), None disables rate limiting
+    rateLimit = None
+
+    # number of requests that can be made in a burst, default to rateLimit[0]
+    rateBurst = None
+
+    # number of concurrent requests per key, None disables concurrency limit
+    concurrencyLimit = None
+
+    # seconds sent in Retry-After when concurrency limit is reached
+    concurrencyRetryAfter = 1
+
+    # 'ip', 'user', 'apikey' or callable(view, request) returning key
+    rateLimitKey = 'ip'
+
+    # request header holding client API key
+    apiKeyHeader = 'X-Api-Key'
+
+    # BucketStore in use, None means get_default_store()
+    rateLimitStore = None
+
+    def get_client_ip(self, request):
+        return request.META.get('REMOTE_ADDR', '')
+
+    def get_rate_limit_key(self, request):
+        "return key identifying the client the limits are applied to"
+
+        kind = self.rateLimitKey
+        if callable(kind):
+            return kind(self, request)
+
+        if kind == 'user':
+            user = getattr(request, 'user', None)
+            if user is not None and user.is_authenticated:
+                return "user:%s" % user.pk
+
+        elif kind == 'apikey':
+            hdr = "HTTP_%s" % self.apiKeyHeader.upper().replace('-', '_')
+            apikey = request.META.get(hdr)
+            if apikey:
+                return "key:%s" % apikey
+
+        return "ip:%s" % self.get_client_ip(request)
+
+    def too_many_requests(self, request, retryAfter):
+        "return 429 response"
+
+        resp = HttpResponse(status=429)
+        resp['Retry-After'] = str(int(math.ceil(retryAfter)))
+        return resp
+
+    def check_rate_limit(self, request):
+        "phase rejecting over limit requests"
+
+        store = self.rateLimitStore or get_default_store()
+        key = "%s:%s" % (
+            self.__class__.__name__, self.get_rate_limit_key(request)
+        )
+
+        if self.rateLimit:
+            count, period = self.rateLimit
+            burst = self.rateBurst or count
+            wait = store.consume(key, count / period, burst)
+            if wait:
+                return self.too_many_requests(request, wait)
+
+        if self.concurrencyLimit:
+            if not store.acquire(key, self.concurrencyLimit):
+                return self.too_many_requests(
+                    request, self.concurrencyRetryAfter
+                )
+
+            # slot is released by the dispatch that acquired it, request
+            # is not marked as batch sub requests copy it
+            self._concurrencySlot = (store, key)
+
+    @method_decorator(csrf_exempt)
+    def dispatch(self, request, *args, **kwargs):
+        self._concurrencySlot = None
+        try:
+            return super(RateLimitMixin, self).dispatch(
+                request, *args, **kwargs
+            )
+        finally:
+            if self._concurrencySlot is not None:
+                store, key = self._concurrencySlot
+                self._concurrencySlot = None
+                store.release(key)
@@ -5,15 +5,54 @@
 
     :email: devel@amvtek.com
 """
-from __future__ import unicode_literals, absolute_import
+from __future__ import unicode_literals, absolute_import, division
+
+import re
 
 from django import template
-from django.core.urlresolvers import reverse
+from django.conf import settings
+from django.core.signals import setting_changed
+from django.core.urlresolvers import reverse, get_urlconf, get_script_prefix
+from django.utils.html import format_html
 
 from ..thumbnailer import build_thumbnail_path
 
 register = template.Library()
 
+# thumbnail paths which reverse does not need to quote
+_isSafePath = re.compile(r"^[0-9a-zA-Z/._-]+$").match
+
+# (viewname, urlconf, script prefix) -> url prefix of thumbnailer view
+_prefixCache = {}
+
+def _clear_prefix_cache(setting, **kwargs):
+    if setting == 'ROOT_URLCONF':
+        _prefixCache.clear()
+
+setting_changed.connect(_clear_prefix_cache)
+
+
+def thumbnail_url(thumbnailer_view, thumbpath):
+    """
+    return url of thumbnailer_view for thumbpath.
+    reverse is called once per URLconf, to find thumbnailer url prefix
+    which is then reused for all the thumbnails...
+    """
+
+    key = (thumbnailer_view, get_urlconf(), get_script_prefix())
+    prefix = _prefixCache.get(key)
+    if prefix is not None and _isSafePath(thumbpath):
+        return prefix + thumbpath
+
+    url = reverse(thumbnailer_view, args=(thumbpath,))
+
+    # url prefix can only be extracted if path is last part of url
+    if _isSafePath(thumbpath) and url.endswith(thumbpath):
+        _prefixCache[key] = url[:-len(thumbpath)]
+
+    return url
+
+
 @register.simple_tag(takes_context=True)
 def thumbnail(context, mpath, width, height=None):
     "return thumbnail url for mpath & dimensions..."
@@ -24,4 +63,54 @@ def thumbnail(context, mpath, width, height=None):
     # calculates thumbnail path
     thumbpath = build_thumbnail_path(mpath, width, height)
 
-    return reverse(thumbnailer_view, args=(thumbpath,))
+    return thumbnail_url(thumbnailer_view, thumbpath)
+
+
+def _parse_ratio(ratio):
+    "return height / width ratio from 'W:H' string or number"
+
+    if isinstance(ratio, (int, float)):
+        return float(ratio)
+    w, _, h = ("%s" % ratio).partition(':')
+    return float(h) / float(w) if h else float(w)
+
+
+@register.simple_tag(takes_context=True)
+def thumbnail_srcset(context, mpath, widths=None, ratio=None, sizes=None):
+    """
+    return srcset & sizes img attributes listing thumbnails of mpath
+    for each of widths, eg :
+
+        <img src="{% thumbnail pic 400 300 %}"
+             {% thumbnail_srcset pic "200,400,800" "4:3" "50vw" %}>
+
+    widths : comma separated list of widths, defaults to setting
+     THUMBNAIL_SRCSET_WIDTHS
+    ratio : thumbnails 'width:height' or height / width, default to square
+    sizes : img sizes attribute, defaults to setting THUMBNAIL_SRCSET_SIZES
+    """
+
+    thumbnailer_view = context.get("thumbnailer_view", "thumbnailer")
+
+    if widths is None:
+        widths = getattr(settings, 'THUMBNAIL_SRCSET_WIDTHS', [])
+    elif not isinstance(widths, (list, tuple)):
+        widths = ("%s" % widths).split(',')
+
+    ratio = _parse_ratio(ratio) if ratio else 1.0
+
+    candidates = []
+    for width in widths:
+        width = int(width)
+        height = max(1, int(round(width * ratio)))
+        thumbpath = build_thumbnail_path(mpath, width, height)
+        candidates.append("%s %iw" % (
+            thumbnail_url(thumbnailer_view, thumbpath), width
+        ))
+
+    sizes = sizes or getattr(settings, 'THUMBNAIL_SRCSET_SIZES', None)
+    if sizes:
+        return format_html(
+            'srcset="{0}" sizes="{1}"', ", ".join(candidates), sizes
+        )
+    return format_html('srcset="{0}"', ", ".join(candidates))
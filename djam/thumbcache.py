@@ -0,0 +1,381 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.thumbcache
+    ~~~~~~~~~~~~~~~
+
+    Size bounded cache for generated thumbnails and TTL cache of storage
+    metadata.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import
+
+import os, time, sqlite3, hashlib, calendar, threading
+from collections import OrderedDict
+
+from django.core.cache import caches
+from django.core.files.base import ContentFile
+from django.utils.encoding import force_bytes
+
+from .utils import LRUCache
+
+__all__ = ['ThumbnailCache', 'StorageStatCache', 'DecodedMasterCache']
+
+
+class ThumbnailCache(object):
+    """
+    Keep generated thumbnails in a Storage under prefix, within a byte budget.
+
+    An index of the cached entries (size, last access time, number of hits)
+    is maintained in a sqlite database shared by all the processes on the
+    host. When a new entry makes the cache exceed maxBytes, least recently
+    used ('lru' policy) or least frequently used ('lfu' policy) entries are
+    evicted until the cache holds less than lowWater * maxBytes.
+    """
+
+    SCHEMA = [
+        "CREATE TABLE IF NOT EXISTS entries ("
+        " name TEXT PRIMARY KEY, size INTEGER, atime REAL, hits INTEGER)",
+        "CREATE INDEX IF NOT EXISTS entries_atime ON entries (atime)",
+    ]
+
+    _evictOrder = {
+        'lru': "atime",
+        'lfu': "hits, atime",
+    }
+
+    def __init__(self, storage, indexPath, maxBytes, prefix='thumbcache/',
+                 policy='lru', lowWater=0.9):
+
+        if policy not in self._evictOrder:
+            raise ValueError("unknown eviction policy %s" % policy)
+
+        self.storage = storage
+        self.indexPath = indexPath
+        self.maxBytes = maxBytes
+        self.prefix = prefix
+        self.policy = policy
+        self.lowWater = lowWater
+
+        # sqlite connections can not be shared in between threads
+        self._local = threading.local()
+
+        # statistics of this process
+        self._statsLock = threading.Lock()
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+
+    @property
+    def db(self):
+        "return sqlite connection for current thread"
+
+        conn = getattr(self._local, 'conn', None)
+        if conn is None or self._local.pid != os.getpid():
+            conn = sqlite3.connect(self.indexPath, timeout=30)
+            conn.execute("PRAGMA journal_mode=WAL")
+            conn.execute("PRAGMA synchronous=NORMAL")
+            for stmt in self.SCHEMA:
+                conn.execute(stmt)
+            conn.commit()
+            self._local.conn = conn
+            self._local.pid = os.getpid()
+        return conn
+
+    def _count(self, stat, n=1):
+        with self._statsLock:
+            setattr(self, stat, getattr(self, stat) + n)
+
+    def get(self, name, count=True):
+        """
+        return storage name of cached thumbnail name or None
+        count set to False excludes lookup from hits & misses statistics
+        """
+
+        db = self.db  # local alias
+        with db:
+            cur = db.execute(
+                "UPDATE entries SET atime = ?, hits = hits + 1 WHERE name = ?",
+                (time.time(), name)
+            )
+        if cur.rowcount:
+            if count:
+                self._count('hits')
+            return "%s%s" % (self.prefix, name)
+
+        if count:
+            self._count('misses')
+        return None
+
+    def put(self, name, content):
+        "cache thumbnail name bytes content, return its storage name"
+
+        storageName = "%s%s" % (self.prefix, name)
+
+        # storage.save never overwrites, it would generate another name
+        if self.storage.exists(storageName):
+            self.storage.delete(storageName)
+        saved = self.storage.save(storageName, ContentFile(content))
+
+        # a concurrent put stored the same thumbnail in between, drop the
+        # copy saved under a name the index would never evict
+        if saved != storageName:
+            self.storage.delete(saved)
+
+        db = self.db  # local alias
+        with db:
+            db.execute(
+                "INSERT OR REPLACE INTO entries VALUES (?, ?, ?, 1)",
+                (name, len(content), time.time())
+            )
+
+        self.evict()
+
+        return storageName
+
+    def discard(self, name):
+        "remove thumbnail name from cache"
+
+        db = self.db  # local alias
+        with db:
+            db.execute("DELETE FROM entries WHERE name = ?", (name,))
+        try:
+            self.storage.delete("%s%s" % (self.prefix, name))
+        except (IOError, OSError):
+            pass
+
+    def evict(self):
+        "evict entries until cache fits within its budget"
+
+        db = self.db  # local alias
+        total = db.execute(
+            "SELECT COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()[0]
+        if total <= self.maxBytes:
+            return
+
+        target = self.lowWater * self.maxBytes
+        evicted = []
+
+        # BEGIN IMMEDIATE prevents concurrent processes evicting twice
+        db.isolation_level = None
+        try:
+            db.execute("BEGIN IMMEDIATE")
+            try:
+                total = db.execute(
+                    "SELECT COALESCE(SUM(size), 0) FROM entries"
+                ).fetchone()[0]
+                cur = db.execute(
+                    "SELECT name, size FROM entries ORDER BY %s"
+                    % self._evictOrder[self.policy]
+                )
+                for name, size in cur:
+                    if total <= target:
+                        break
+                    evicted.append(name)
+                    total -= size
+                db.executemany(
+                    "DELETE FROM entries WHERE name = ?",
+                    [(n,) for n in evicted]
+                )
+                db.execute("COMMIT")
+            except Exception:
+                db.execute("ROLLBACK")
+                raise
+        finally:
+            db.isolation_level = ''
+
+        for name in evicted:
+            try:
+                self.storage.delete("%s%s" % (self.prefix, name))
+            except (IOError, OSError):
+                pass
+        self._count('evictions', len(evicted))
+
+    def stats(self):
+        "return dict of cache statistics"
+
+        entries, size = self.db.execute(
+            "SELECT COUNT(*), COALESCE(SUM(size), 0) FROM entries"
+        ).fetchone()
+
+        with self._statsLock:
+            lookups = self.hits + self.misses
+            return dict(
+                hits=self.hits,
+                misses=self.misses,
+                evictions=self.evictions,
+                hitRatio=(float(self.hits) / lookups) if lookups else None,
+                entries=entries,
+                bytes=size,
+                maxBytes=self.maxBytes,
+            )
+
+
+def _timestamp(dt):
+    "return POSIX timestamp of datetime returned by storage"
+
+    if getattr(dt, 'tzinfo', None) is not None:
+        return calendar.timegm(dt.utctimetuple())
+    return int(time.mktime(dt.timetuple()))
+
+
+class StorageStatCache(object):
+    """
+    TTL cache of storage files existence & metadata (size, mtime, format)
+    so that remote storages (eg S3) are not queried for every request.
+    Missing files are cached for negativeTtl seconds.
+
+    Entries are kept in process memory (at most maxEntries) or in the
+    django cache named alias. ttl set to 0 disables caching.
+    """
+
+    def __init__(self, ttl=60, negativeTtl=None, alias=None, maxEntries=10000):
+
+        self.ttl = ttl
+        self.negativeTtl = ttl if negativeTtl is None else negativeTtl
+        self.maxEntries = maxEntries
+        self.cache = caches[alias] if alias else None
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()
+
+    def _key(self, storage, name):
+        location = getattr(storage, 'location', storage.__class__.__name__)
+        h = hashlib.sha1(force_bytes("%s\0%s" % (location, name)))
+        return "djam.statcache.%s" % h.hexdigest()
+
+    def _get(self, key):
+        "return cached entry, None if missing file, False if not cached"
+
+        if self.cache is not None:
+            entry = self.cache.get(key)
+            return False if entry is None else entry.get('stat')
+
+        with self._lock:
+            entry = self._entries.get(key)
+            if entry is None:
+                return False
+            expires, stat = entry
+            if expires < time.time():
+                del self._entries[key]
+                return False
+            return stat
+
+    def _set(self, key, stat):
+
+        ttl = self.ttl if stat is not None else self.negativeTtl
+        if not ttl:
+            return
+
+        if self.cache is not None:
+            # wrapped as django cache can not store None
+            self.cache.set(key, {'stat': stat}, ttl)
+            return
+
+        with self._lock:
+            self._entries.pop(key, None)
+            self._entries[key] = (time.time() + ttl, stat)
+            while len(self._entries) > self.maxEntries:
+                self._entries.popitem(last=False)
+
+    def load(self, storage, name, exists=False):
+        """
+        return dict(size, mtime) querying storage or None if missing
+        exists set to True skips the existence query
+        """
+
+        if not (exists or storage.exists(name)):
+            return None
+
+        try:
+            size = storage.size(name)
+            # modified_time was deprecated in django 1.10
+            mtime = getattr(storage, 'get_modified_time', None)
+            mtime = _timestamp((mtime or storage.modified_time)(name))
+        except (NotImplementedError, AttributeError):
+            size = mtime = None
+        except (IOError, OSError):
+            # file was removed
+            return None
+
+        return dict(size=size, mtime=mtime)
+
+    def stat(self, storage, name, exists=False):
+        """
+        return None if name does not exist in storage
+        or dict(size, mtime, ...) in which unknown values are None
+        exists set to True skips the existence query of a name known to exist
+        """
+
+        key = self._key(storage, name)
+        stat = self._get(key)
+        if stat is False:
+            stat = self.load(storage, name, exists)
+            self._set(key, stat)
+        elif stat is not None and 'size' not in stat:
+            # only existence was cached
+            meta = self.load(storage, name, True)
+            stat = None if meta is None else dict(stat, **meta)
+            self._set(key, stat)
+        return stat
+
+    def exists(self, storage, name, cacheMissing=True):
+        """
+        return True if name exists in storage, not querying its metadata
+        cacheMissing set to False does not cache a missing name
+        """
+
+        key = self._key(storage, name)
+        stat = self._get(key)
+        if stat is False:
+            stat = {} if storage.exists(name) else None
+            if stat is not None or cacheMissing:
+                self._set(key, stat)
+        return stat is not None
+
+    def update(self, storage, name, **meta):
+        "record extra metadata (eg format) for existing name"
+
+        key = self._key(storage, name)
+        stat = self._get(key)
+        if stat is not False and stat is not None:
+            stat = dict(stat, **meta)
+            self._set(key, stat)
+
+    def forget(self, storage, name):
+        "drop cached entry of name, to be called when name is changed"
+
+        key = self._key(storage, name)
+        if self.cache is not None:
+            self.cache.delete(key)
+        else:
+            with self._lock:
+                self._entries.pop(key, None)
+
+
+class DecodedMasterCache(LRUCache):
+    """
+    Short lived, memory bounded LRU cache of decoded master pictures.
+    Entries are (scale, picture) where scale is the ratio in between master
+    and decoded picture widths. They expire after ttl seconds and least
+    recently used ones are dropped when the estimated memory of the cached
+    pictures exceeds maxBytes.
+    """
+
+    def __init__(self, maxBytes, ttl=30):
+        super(DecodedMasterCache, self).__init__(maxBytes=maxBytes, ttl=ttl)
+
+    @staticmethod
+    def sizeof(picture):
+        "return estimated memory used by decoded picture"
+
+        width, height = picture.size
+        # PIL stores multiband pixels on 4 bytes
+        bpp = 1 if picture.mode in ('1', 'L', 'P') else 4
+        return width * height * bpp
+
+    def put(self, key, scale, picture):
+        super(DecodedMasterCache, self).put(
+            key, (scale, picture), self.sizeof(picture)
+        )
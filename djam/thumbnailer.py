@@ -9,8 +9,11 @@
 """
 from __future__ import unicode_literals
 
-import re
+import os, re, hashlib, logging, threading
+from contextlib import contextmanager
+from io import BytesIO
 from os.path import splitext
+from multiprocessing import Pool, TimeoutError
 
 from PIL import Image, ImageOps
 
@@ -18,10 +21,80 @@ from django.conf import settings
 from django.core.files.base import ContentFile
 from django.core.files.storage import default_storage
 from django.views.generic.base import View
-from django.http import HttpResponse, HttpResponseNotFound
+from django.http import (
+    HttpResponse, HttpResponseNotFound, HttpResponseNotModified, FileResponse
+)
+from django.utils.encoding import force_bytes
+from django.utils.cache import patch_vary_headers
+from django.utils.http import http_date, parse_http_date_safe
+
+from .thumbcache import ThumbnailCache, StorageStatCache, DecodedMasterCache
+from .utils import is_not_modified
+
+logger = logging.getLogger(__name__)
+
+# raised by PIL when image exceeds Image.MAX_IMAGE_PIXELS limits
+_DecompressionBombError = getattr(Image, 'DecompressionBombError', ())
+
+# Image.ANTIALIAS was removed in Pillow 10
+_ANTIALIAS = getattr(Image, 'LANCZOS', None) or Image.ANTIALIAS
+
+_RGB_ONLY = frozenset(['WEBP', 'AVIF'])
+
+def pil_can_save(fmt):
+    "return True if installed PIL can encode fmt (eg 'webp')"
+
+    Image.init()
+    return fmt.upper() in Image.SAVE
+
+
+def accepts_mimetype(accept, mimetype):
+    "return True if Accept header explicitly allows mimetype"
+
+    for mrange in (accept or '').split(','):
+        parts = mrange.split(';')
+        if parts[0].strip().lower() != mimetype:
+            continue
+        for param in parts[1:]:
+            name, _, value = param.partition('=')
+            if name.strip() == 'q':
+                try:
+                    return float(value) > 0
+                except ValueError:
+                    return False
+        return True
+    return False
 
 _parseThumbRegex = re.compile(r"\s*([0-9a-zA-Z/]+)-w(\d+)-h(\d+)\.(\w+)")
 
+_parseRangeRegex = re.compile(r"^\s*bytes\s*=\s*(\d*)\s*-\s*(\d*)\s*$")
+
+def parse_range(header, size):
+    """
+    return (start, end) inclusive positions for single byte range header
+    None if header can not be honored, or False if range is unsatisfiable
+    """
+
+    m = _parseRangeRegex.match(header or '')
+    if m is None:
+        return None
+
+    start, end = m.groups()
+    if not start:
+        # suffix range eg bytes=-500
+        if not end:
+            return None
+        length = int(end)
+        if not length:
+            return False
+        return max(0, size - length), size - 1
+
+    start = int(start)
+    end = min(int(end), size - 1) if end else size - 1
+    if start > end:
+        return False if start >= size else None
+    return start, end
+
 def parse_thumbnail_infos(filename):
     "return mastername,extension,(width,height)..."
 
@@ -31,6 +104,8 @@ def parse_thumbnail_infos(filename):
         mastername = "%s.%s" % (m.group(1), m.group(4))
         extension = m.group(4)
         size = (int(m.group(2)), int(m.group(3)))
+        if not all(size):
+            return None
         return mastername, extension, size
 
 
@@ -52,6 +127,394 @@ def build_thumbnail_path(mpath, width, height=None):
     return "%(basename)s-w%(width)i-h%(height)i%(extension)s" % locals()
 
 
+def parse_size(preset):
+    "return (width, height) from (width, height), 'WxH' or width preset"
+
+    if isinstance(preset, (tuple, list)):
+        width, height = preset
+    else:
+        width, _, height = ("%s" % preset).partition('x')
+    return int(width), int(height or width)
+
+
+def reduction_factor(masterSize, targetSize, oversampling=2):
+    """
+    return largest integer factor master can be shrunk by while keeping
+    oversampling times the resolution ImageOps.fit needs for targetSize
+    """
+
+    width, height = masterSize
+    tw, th = targetSize
+
+    # scale of master region that ImageOps.fit crops for targetSize
+    scale = min(float(width) / tw, float(height) / th)
+    return max(1, int(scale / oversampling))
+
+
+def can_reduce(picture):
+    "return True if picture can be shrunk using Image.reduce"
+
+    # palette & bilevel pixels can not be averaged
+    return picture.mode not in ('1', 'P') and \
+        callable(getattr(picture, 'reduce', None))
+
+
+def reduce_master(picture, targetSize, oversampling=2, minFactor=1):
+    """
+    return picture shrunk by reduction_factor, or at least by minFactor.
+    JPEG masters are decoded at reduced scale using draft mode, others
+    are reduced by box averaging which is cheaper than resampling...
+    """
+
+    width, height = picture.size
+    factor = minFactor
+    if targetSize:
+        factor = max(factor, reduction_factor(picture.size, targetSize, oversampling))
+    if factor < 2:
+        return picture
+
+    if picture.format == 'JPEG':
+        # picture shall not be loaded yet for draft to work
+        picture.draft(picture.mode, (width // factor, height // factor))
+        return picture
+
+    if can_reduce(picture):
+        return picture.reduce(factor)
+
+    return picture
+
+
+class MasterTooLarge(IOError):
+    "raised when master image exceeds configured size limits..."
+    pass
+
+
+# largest reduction JPEG draft mode can achieve
+_MAX_DRAFT_FACTOR = 8
+
+def decode_master(source, targetSize=None, fastDecode=True,
+                  maxPixels=None, decodePixels=None):
+    """
+    return (picture, scale, format) where picture is the loaded master
+    image, decoded at reduced resolution if fastDecode is set, scale is
+    the ratio in between master and picture widths...
+
+    Masters of more than maxPixels are rejected raising MasterTooLarge,
+    before any pixel is decoded. Masters of more than decodePixels are
+    decoded at reduced resolution so that the decoded picture holds at
+    most decodePixels, which is only possible for JPEG masters.
+    """
+
+    try:
+        picture = Image.open(source)
+    except _DecompressionBombError as exc:
+        raise MasterTooLarge(str(exc))
+
+    width, height = picture.size
+    fmt = picture.format
+    pixels = width * height
+
+    if maxPixels and pixels > maxPixels:
+        raise MasterTooLarge(
+            "master holds %i pixels, limit is %i" % (pixels, maxPixels)
+        )
+
+    minFactor = 1
+    if decodePixels and pixels > decodePixels:
+        # draft mode reduces by powers of 2
+        minFactor = 2
+        while pixels > decodePixels * minFactor * minFactor:
+            minFactor *= 2
+        if fmt != 'JPEG' or minFactor > _MAX_DRAFT_FACTOR:
+            raise MasterTooLarge(
+                "master holds %i pixels and can not be decoded within %i"
+                % (pixels, decodePixels)
+            )
+
+    if (fastDecode and targetSize) or minFactor > 1:
+        picture = reduce_master(
+            picture, targetSize if fastDecode else None, minFactor=minFactor
+        )
+    picture.load()
+
+    return picture, float(width) / picture.size[0], fmt
+
+
+def encode_thumbnail(picture, targetSize, save_as, options=None):
+    """
+    return bytes of thumbnail of targetSize made from decoded picture
+    options are passed to PIL encoder (eg quality...)
+    """
+
+    # resize master picture if necessary
+    if targetSize != picture.size:
+        picture = ImageOps.fit(picture, targetSize, _ANTIALIAS)
+
+    # webp & avif encoders only accept RGB(A) pictures
+    if save_as in _RGB_ONLY and picture.mode not in ('RGB', 'RGBA'):
+        hasAlpha = 'A' in picture.mode or 'transparency' in picture.info
+        picture = picture.convert('RGBA' if hasAlpha else 'RGB')
+
+    buf = BytesIO()
+    picture.save(buf, save_as, **(options or {}))
+    return buf.getvalue()
+
+
+def render_thumbnail(source, targetSize, save_as, fastDecode=True,
+                     options=None, limits=None):
+    """
+    return bytes of thumbnail of targetSize made from source image file
+    limits maybe a dict of decode_master maxPixels & decodePixels...
+    """
+
+    picture, scale, fmt = decode_master(
+        source, targetSize, fastDecode, **(limits or {})
+    )
+    return encode_thumbnail(picture, targetSize, save_as, options)
+
+
+def _render_job(data, targetSize, save_as, fastDecode, options, limits):
+    """
+    RenderPool job returning (ok, content or error, decoded bytes)
+    errors are returned so that callback always runs...
+    """
+
+    try:
+        picture, scale, fmt = decode_master(
+            BytesIO(data), targetSize, fastDecode, **(limits or {})
+        )
+        content = encode_thumbnail(picture, targetSize, save_as, options)
+        return True, content, DecodedMasterCache.sizeof(picture)
+    except Exception as exc:
+        # MasterTooLarge is preserved, other errors are sent as IOError
+        if not isinstance(exc, IOError):
+            logger.exception("rendering of thumbnail failed")
+        cls = MasterTooLarge if isinstance(exc, MasterTooLarge) else IOError
+        return False, cls(str(exc)), 0
+
+
+class RenderStats(object):
+    """
+    Counters of the thumbnails rendered by this process.
+    Decoded bytes are estimated from decoded pictures dimensions, maxRss is
+    the peak resident memory of the process as reported by the OS.
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self.jobs = 0
+        self.rejected = 0
+        self.lastDecodedBytes = 0
+        self.peakDecodedBytes = 0
+        self.totalDecodedBytes = 0
+
+    def record(self, decodedBytes):
+        with self._lock:
+            self.jobs += 1
+            self.lastDecodedBytes = decodedBytes
+            self.peakDecodedBytes = max(self.peakDecodedBytes, decodedBytes)
+            self.totalDecodedBytes += decodedBytes
+
+    def reject(self):
+        with self._lock:
+            self.rejected += 1
+
+    def stats(self):
+
+        try:
+            import resource
+            maxRss = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+            maxRss *= 1024  # linux reports KiB
+        except ImportError:
+            maxRss = None
+
+        with self._lock:
+            return dict(
+                jobs=self.jobs, rejected=self.rejected,
+                lastDecodedBytes=self.lastDecodedBytes,
+                peakDecodedBytes=self.peakDecodedBytes,
+                totalDecodedBytes=self.totalDecodedBytes,
+                maxRss=maxRss,
+            )
+
+renderStats = RenderStats()
+
+
+class ThumbnailerBusy(Exception):
+    "raised when RenderPool can not accept or complete a job in time..."
+    pass
+
+
+class RenderPool(object):
+    """
+    Bounded process pool rendering thumbnails out of the request thread.
+    Pool processes are started on first use, so that each web worker process
+    owns its pool. When queueDepth jobs are pending, render fails fast
+    raising ThumbnailerBusy.
+    """
+
+    def __init__(self, processes, queueDepth=None, timeout=10):
+
+        self.processes = processes
+        self.queueDepth = queueDepth or 2 * processes
+        self.timeout = timeout
+
+        self._pool = None
+        self._pid = None
+        self._lock = threading.Lock()
+        self._slots = threading.Semaphore(self.queueDepth)
+
+    def get_pool(self):
+
+        pid = os.getpid()
+        if self._pid != pid:
+            with self._lock:
+                if self._pid != pid:
+                    self._pool = Pool(self.processes)
+                    self._pid = pid
+        return self._pool
+
+    def render(self, data, targetSize, save_as, fastDecode=True,
+               options=None, limits=None):
+        """
+        return (thumbnail bytes, decoded bytes)
+        raise IOError if data can not be decoded
+        """
+
+        if not self._slots.acquire(False):
+            raise ThumbnailerBusy("render queue is full")
+
+        # slot is released when job completes, even after a timeout
+        def release(rv):
+            self._slots.release()
+
+        try:
+            job = self.get_pool().apply_async(
+                _render_job,
+                (data, targetSize, save_as, fastDecode, options, limits),
+                callback=release
+            )
+        except Exception:
+            self._slots.release()
+            raise
+
+        try:
+            ok, rv, decodedBytes = job.get(self.timeout)
+        except TimeoutError:
+            raise ThumbnailerBusy("render timeout")
+
+        if not ok:
+            raise rv
+        return rv, decodedBytes
+
+
+class _Flight(object):
+
+    def __init__(self):
+        self.done = threading.Event()
+        self.result = None
+        self.error = None
+
+
+class SingleFlight(object):
+    """
+    Coalesce concurrent calls sharing the same key : first caller runs the
+    call, the others wait for and share its result (or exception).
+    """
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._flights = {}
+
+    def do(self, key, func, *args):
+
+        with self._lock:
+            flight = self._flights.get(key)
+            leader = flight is None
+            if leader:
+                flight = self._flights[key] = _Flight()
+
+        if not leader:
+            flight.done.wait()
+            if flight.error is not None:
+                raise flight.error
+            return flight.result
+
+        try:
+            flight.result = func(*args)
+            return flight.result
+        except Exception as exc:
+            flight.error = exc
+            raise
+        finally:
+            with self._lock:
+                del self._flights[key]
+            flight.done.set()
+
+
+@contextmanager
+def host_lock(lockdir, key, stripes=1024):
+    """
+    hold exclusive lock on key shared by all processes on the host.
+    Keys are spread over a fixed number of lock files... (Unix only)
+    """
+
+    import fcntl
+
+    h = int(hashlib.sha1(force_bytes(key)).hexdigest(), 16) % stripes
+    fd = os.open(
+        os.path.join(lockdir, "thumbnail-%04i.lock" % h),
+        os.O_RDWR | os.O_CREAT, 0o644
+    )
+    try:
+        fcntl.flock(fd, fcntl.LOCK_EX)
+        yield
+    finally:
+        os.close(fd)  # releases flock
+
+
+def _make_render_pool():
+
+    processes = getattr(settings, 'THUMBNAIL_POOL_SIZE', 0)
+    if processes:
+        return RenderPool(
+            processes,
+            getattr(settings, 'THUMBNAIL_POOL_QUEUE', None),
+            getattr(settings, 'THUMBNAIL_POOL_TIMEOUT', 10)
+        )
+
+
+def _make_stat_cache():
+
+    config = getattr(settings, 'THUMBNAIL_STAT_CACHE', None) or {}
+    return StorageStatCache(
+        ttl=config.get('TTL', 0),
+        negativeTtl=config.get('NEGATIVE_TTL'),
+        alias=config.get('CACHE'),
+        maxEntries=config.get('MAX_ENTRIES', 10000)
+    )
+
+
+def _make_master_cache():
+
+    maxBytes = getattr(settings, 'THUMBNAIL_MASTER_CACHE_BYTES', 0)
+    if maxBytes:
+        return DecodedMasterCache(
+            maxBytes, getattr(settings, 'THUMBNAIL_MASTER_CACHE_TTL', 30)
+        )
+
+
+def _make_thumbnail_cache():
+
+    config = getattr(settings, 'THUMBNAIL_CACHE', None)
+    if config:
+        return ThumbnailCache(
+            default_storage, config['INDEX'], config['MAX_BYTES'],
+            prefix=config.get('PREFIX', 'thumbcache/'),
+            policy=config.get('POLICY', 'lru')
+        )
+
+
 class Thumbnailer(View):
     """
     View class that generates a thumbnail from an image retrieved from storage.
@@ -59,6 +522,59 @@ class Thumbnailer(View):
 
     Generated thumbnails maybe cached and served by a 'static' webserver such
     as Nginx or Apache... 
+
+    Instead of saving every generated thumbnail forever (THUMBNAIL_SAVE),
+    thumbnails can be kept in a size bounded ThumbnailCache configured by
+    setting THUMBNAIL_CACHE, eg :
+        THUMBNAIL_CACHE = {
+            'INDEX': '/var/cache/myapp/thumbnails.sqlite',
+            'MAX_BYTES': 2 * 1024 ** 3,
+            'PREFIX': 'thumbcache/',  # optional
+            'POLICY': 'lru',  # optional, 'lru' or 'lfu'
+        }
+
+    Concurrent requests for the same thumbnail are coalesced so that it is
+    rendered once per process. If thumbnails are kept and setting
+    THUMBNAIL_LOCK_DIR is set, a file lock extends this to all processes on
+    the host, the first one storing the thumbnail the others then read.
+
+    Existing thumbnails are served with ETag & Last-Modified validators
+    and support conditional & Range requests. Setting THUMBNAIL_SERVE_MODE
+    allows delegating file transfer to the front webserver :
+        * 'python' : default, file is streamed by Django FileResponse
+        * 'x-accel-redirect' : nginx, THUMBNAIL_ACCEL_PREFIX is prepended to
+          file name to form internal location
+        * 'x-sendfile' : apache mod_xsendfile, requires local storage
+
+    Thumbnails maybe encoded in another format than the master one, when
+    the Accept header of the request allows it. Setting THUMBNAIL_FORMATS
+    lists formats in order of preference eg ('avif', 'webp'), formats that
+    installed PIL can not encode being ignored. Negotiated thumbnails are
+    stored under the thumbnail name suffixed with the format extension.
+    Setting THUMBNAIL_QUALITY defines encoders quality per format.
+
+    Storage existence & metadata queries maybe cached, which matters for
+    remote storages, using setting THUMBNAIL_STAT_CACHE, eg :
+        THUMBNAIL_STAT_CACHE = {
+            'TTL': 300,  # seconds, default 0 disables caching
+            'NEGATIVE_TTL': 30,  # seconds missing masters are cached
+            'CACHE': None,  # django cache alias, None is process memory
+        }
+
+    Memory used to render a thumbnail is bounded using settings :
+        * THUMBNAIL_MAX_MASTER_BYTES : masters files exceeding it are rejected
+        * THUMBNAIL_MAX_PIXELS : masters holding more pixels are rejected
+          before being decoded
+        * THUMBNAIL_DECODE_PIXELS : masters holding more pixels are decoded
+          at reduced resolution (JPEG) or rejected (other formats)
+    renderStats reports decoded bytes & peak memory.
+
+    If setting THUMBNAIL_POOL_SIZE is set, thumbnails are rendered by a pool
+    of THUMBNAIL_POOL_SIZE processes, see RenderPool. Otherwise decoded
+    masters maybe kept for THUMBNAIL_MASTER_CACHE_TTL seconds within a
+    budget of THUMBNAIL_MASTER_CACHE_BYTES, so that several sizes of one
+    master requested together only decode it once. Cached masters are
+    decoded with enough resolution for all the THUMBNAIL_PRESETS sizes.
     """
 
     storage = default_storage
@@ -66,48 +582,354 @@ class Thumbnailer(View):
     saveThumbnail = getattr(settings,'THUMBNAIL_SAVE',False)
     
     lifetime = getattr(settings,'THUMBNAIL_CACHE_TIME', 900 ) # 900 sec = 15 mn
-    
+
+    # None means render in request thread
+    renderPool = _make_render_pool()
+
+    # seconds sent in Retry-After when renderPool is busy
+    retryAfter = getattr(settings, 'THUMBNAIL_RETRY_AFTER', 1)
+
+    # 'python', 'x-accel-redirect' or 'x-sendfile'
+    serveMode = getattr(settings, 'THUMBNAIL_SERVE_MODE', 'python')
+
+    # nginx internal location holding storage files
+    accelPrefix = getattr(settings, 'THUMBNAIL_ACCEL_PREFIX', '/protected/')
+
+    # decode large masters at reduced resolution, see reduce_master
+    fastDecode = getattr(settings, 'THUMBNAIL_FAST_DECODE', True)
+
+    # masters exceeding those limits are rejected
+    maxMasterBytes = getattr(settings, 'THUMBNAIL_MAX_MASTER_BYTES', None)
+    maxPixels = getattr(settings, 'THUMBNAIL_MAX_PIXELS', None)
+
+    # masters of more pixels are decoded at reduced resolution
+    decodePixels = getattr(settings, 'THUMBNAIL_DECODE_PIXELS', None)
+
+    renderStats = renderStats
+
+    # folder holding host wide lock files, None disables host locking
+    lockDir = getattr(settings, 'THUMBNAIL_LOCK_DIR', None)
+
+    singleFlight = SingleFlight()
+
+    # formats negotiated using Accept header in order of preference
+    negotiatedFormats = [
+        f for f in getattr(settings, 'THUMBNAIL_FORMATS', ()) if pil_can_save(f)
+    ]
+
+    # encoder quality per format eg {'webp': 80, 'avif': 60}
+    quality = getattr(settings, 'THUMBNAIL_QUALITY', {})
+
+    # cache of storage existence & metadata, see StorageStatCache
+    statCache = _make_stat_cache()
+
+    # cache of decoded masters, see DecodedMasterCache
+    masterCache = _make_master_cache()
+
+    # sizes commonly requested, cached masters are decoded to fit them all
+    presets = [parse_size(p) for p in getattr(settings, 'THUMBNAIL_PRESETS', [])]
+
+    # ThumbnailCache replacing THUMBNAIL_SAVE mode, if THUMBNAIL_CACHE is set
+    thumbnailCache = _make_thumbnail_cache()
+
+    def render(self, mastername, ext, targetSize):
+        "return thumbnail content, raise IOError if master is not an image"
+
+        save_as = ext
+        if ext == "jpg":
+            save_as = "JPEG"
+
+        options = {}
+        quality = self.quality.get(ext.lower())
+        if quality is not None:
+            options['quality'] = quality
+
+        # reject oversized master before reading it
+        if self.maxMasterBytes:
+            stat = self.statCache.stat(self.storage, mastername, True)
+            if stat and (stat['size'] or 0) > self.maxMasterBytes:
+                raise MasterTooLarge(
+                    "%s exceeds %i bytes" % (mastername, self.maxMasterBytes)
+                )
+
+        limits = dict(maxPixels=self.maxPixels, decodePixels=self.decodePixels)
+
+        if self.renderPool is None:
+            if self.masterCache is not None:
+                picture = self.get_decoded_master(mastername, targetSize)
+            else:
+                picture, scale, fmt = decode_master(
+                    self.storage.open(mastername), targetSize,
+                    self.fastDecode, **limits
+                )
+                self.renderStats.record(DecodedMasterCache.sizeof(picture))
+            return encode_thumbnail(picture, targetSize, save_as, options)
+
+        data = self.storage.open(mastername).read()
+        content, decodedBytes = self.renderPool.render(
+            data, targetSize, save_as, self.fastDecode, options, limits
+        )
+        self.renderStats.record(decodedBytes)
+        return content
+
+    def decode(self, mastername, targetSize, key):
+        """
+        decode master with enough resolution for targetSize & presets sizes
+        and keep it in masterCache
+        """
+
+        sizes = [targetSize] + self.presets
+        decodeSize = (max(w for w, h in sizes), max(h for w, h in sizes))
+
+        picture, scale, fmt = decode_master(
+            self.storage.open(mastername), decodeSize, self.fastDecode,
+            self.maxPixels, self.decodePixels
+        )
+        self.renderStats.record(DecodedMasterCache.sizeof(picture))
+        self.masterCache.put(key, scale, picture)
+        self.statCache.update(self.storage, mastername, format=fmt)
+        return scale, picture
+
+    def get_decoded_master(self, mastername, targetSize):
+        """
+        return master picture with enough resolution for targetSize,
+        reusing picture decoded for a previous request if possible
+        """
+
+        stat = self.statCache.stat(self.storage, mastername, True)
+        key = (mastername, stat and stat['mtime'])
+
+        entry = self.masterCache.get(key)
+        if entry is None:
+            # concurrent requests for sizes of one master decode it once
+            entry = self.singleFlight.do(
+                ('decode',) + key, self.decode, mastername, targetSize, key
+            )
+
+        scale, picture = entry
+        masterSize = [int(round(d * scale)) for d in picture.size]
+        needed = reduction_factor(masterSize, targetSize)\
+            if self.fastDecode else 1
+
+        # masters exceeding decodePixels can not be decoded at a better scale
+        bounded = self.decodePixels and \
+            masterSize[0] * masterSize[1] > self.decodePixels
+
+        # resolution of decoded picture is too low for targetSize
+        if scale > needed * 1.01 and not bounded:
+            scale, picture = self.singleFlight.do(
+                ('decode', needed) + key,
+                self.decode, mastername, targetSize, key
+            )
+
+        extra = int(needed / scale)
+        if extra >= 2 and can_reduce(picture):
+            picture = picture.reduce(extra)
+
+        return picture
+
+    def lookup(self, filename):
+        "return storage name of previously generated thumbnail or None"
+
+        if self.thumbnailCache is not None:
+            # lookup was already accounted for in cache statistics
+            return self.thumbnailCache.get(filename, count=False)
+        if self.saveThumbnail and self.storage.exists(filename):
+            return filename
+
+    def store(self, filename, content):
+        "keep generated thumbnail content if configured to do so"
+
+        if self.thumbnailCache is not None:
+            stored = self.thumbnailCache.put(filename, content)
+        elif self.saveThumbnail:
+            stored = self.storage.save(filename, ContentFile(content))
+            if stored != filename:
+                # a concurrent request saved it first, drop the duplicate
+                # storage.save kept under another name
+                self.storage.delete(stored)
+                stored = filename
+        else:
+            return
+
+        # drop cached negative existence results
+        self.statCache.forget(self.storage, filename)
+        if stored != filename:
+            self.statCache.forget(self.storage, stored)
+
+    def generate(self, filename, mastername, ext, targetSize):
+        "return content of thumbnail filename, rendering and storing it"
+
+        keep = self.saveThumbnail or self.thumbnailCache is not None
+
+        if not (keep and self.lockDir):
+            content = self.render(mastername, ext, targetSize)
+            self.store(filename, content)
+            return content
+
+        with host_lock(self.lockDir, filename):
+
+            # another process may have stored it while we were waiting
+            stored = self.lookup(filename)
+            if stored is not None:
+                return self.storage.open(stored).read()
+
+            content = self.render(mastername, ext, targetSize)
+            self.store(filename, content)
+            return content
+
+    def get_validators(self, filename, stat=None):
+        """
+        return (etag, lastModified timestamp, size) for stored filename
+        raise IOError if filename is missing
+        """
+
+        stat = stat or self.statCache.stat(self.storage, filename, True)
+        if stat is None:
+            raise IOError("%s does not exist" % filename)
+
+        size, lastModified = stat['size'], stat['mtime']
+        if size is None or lastModified is None:
+            return None, None, None
+
+        etag = '"%x-%x"' % (lastModified, size)
+        return etag, lastModified, size
+
+    def serve(self, request, filename, ext, stat=None):
+        """
+        return response transferring stored filename
+        stat maybe set to avoid querying storage metadata again
+        """
+
+        etag, lastModified, size = self.get_validators(filename, stat)
+
+        def set_headers(resp):
+            resp["Cache-Control"] = 'max-age=%s' % self.lifetime
+            if etag is not None:
+                resp["ETag"] = etag
+                resp["Last-Modified"] = http_date(lastModified)
+            return resp
+
+        if etag is not None and is_not_modified(request, etag, lastModified):
+            return set_headers(HttpResponseNotModified())
+
+        contentType = "image/%s" % ext
+
+        if self.serveMode == 'x-accel-redirect':
+            resp = HttpResponse(content_type=contentType)
+            resp["X-Accel-Redirect"] = "%s%s" % (self.accelPrefix, filename)
+            return set_headers(resp)
+
+        if self.serveMode == 'x-sendfile':
+            resp = HttpResponse(content_type=contentType)
+            resp["X-Sendfile"] = self.storage.path(filename)
+            return set_headers(resp)
+
+        picfile = self.storage.open(filename)
+
+        # honor single byte range if resource did not change
+        brange = None
+        rangeHdr = request.META.get('HTTP_RANGE')
+        if rangeHdr and size is not None:
+            ifRange = request.META.get('HTTP_IF_RANGE')
+            if ifRange is None or ifRange == etag or \
+                    parse_http_date_safe(ifRange) == lastModified:
+                brange = parse_range(rangeHdr, size)
+
+        if brange is False:
+            picfile.close()
+            resp = HttpResponse(status=416)
+            resp["Content-Range"] = "bytes */%i" % size
+            return resp
+
+        if brange is not None:
+            start, end = brange
+            picfile.seek(start)
+            content = picfile.read(end - start + 1)
+            picfile.close()
+            resp = HttpResponse(
+                content=content, status=206, content_type=contentType
+            )
+            resp["Content-Range"] = "bytes %i-%i/%i" % (start, end, size)
+        else:
+            # FileResponse allows wsgi.file_wrapper (sendfile) to be used
+            resp = FileResponse(picfile, content_type=contentType)
+            if size is not None:
+                resp["Content-Length"] = str(size)
+
+        resp["Accept-Ranges"] = "bytes"
+        return set_headers(resp)
+
+    def negotiate_format(self, request):
+        "return preferred format the client accepts or None"
+
+        accept = request.META.get('HTTP_ACCEPT')
+        for fmt in self.negotiatedFormats:
+            if accepts_mimetype(accept, "image/%s" % fmt):
+                return fmt
 
     def get(self, request, path):
 
+        resp = self.get_thumbnail(request, path)
+        if self.negotiatedFormats and parse_thumbnail_infos(path) is not None:
+            patch_vary_headers(resp, ('Accept',))
+        return resp
+
+    def get_thumbnail(self, request, path):
+
         filename = path
         name, ext = filename.split(".")
 
-        # returns file if it is currently in the storage
-        if self.storage.exists(filename):
-            picfile = self.storage.open(filename)
-            resp = HttpResponse(content=picfile, content_type="image/%s" % ext)
-            resp["Cache-Control"] = 'max-age=%s' % self.lifetime
-            return resp
+        # thumbnail may be encoded in a negotiated format
+        rv = parse_thumbnail_infos(filename)
+        if rv is not None and self.negotiatedFormats:
+            fmt = self.negotiate_format(request)
+            if fmt is not None:
+                ext = fmt
+                filename = "%s.%s" % (filename, fmt)
+
+        # returns file if it is currently in the storage, missing thumbnails
+        # are not cached as other processes may be generating them
+        if self.statCache.exists(self.storage, filename, rv is None):
+            try:
+                return self.serve(request, filename, ext)
+            except (IOError, OSError):
+                # file was removed after it was cached
+                self.statCache.forget(self.storage, filename)
 
         # if file not in storage it may encode thumbnail dimensions
-        rv = parse_thumbnail_infos(filename)
         if rv is None:
             return HttpResponseNotFound()
-        mastername, ext, targetSize = rv
+        mastername, masterext, targetSize = rv
 
-        if not self.storage.exists(mastername):
+        # serve thumbnail from cache if any
+        if self.thumbnailCache is not None:
+            cached = self.thumbnailCache.get(filename)
+            if cached is not None:
+                try:
+                    return self.serve(request, cached, ext)
+                except (IOError, OSError):
+                    # index is out of sync with storage
+                    self.statCache.forget(self.storage, cached)
+                    self.thumbnailCache.discard(filename)
+
+        if not self.statCache.exists(self.storage, mastername):
             return HttpResponseNotFound()
         try:
-            picture = Image.open(self.storage.open(mastername))
+            content = self.singleFlight.do(
+                filename, self.generate, filename, mastername, ext, targetSize
+            )
+        except MasterTooLarge as exc:
+            self.renderStats.reject()
+            logger.warning("thumbnail %s rejected : %s", filename, exc)
+            return HttpResponseNotFound()
         except IOError:
             return HttpResponseNotFound()
+        except ThumbnailerBusy:
+            resp = HttpResponse(status=503)
+            resp["Retry-After"] = str(self.retryAfter)
+            return resp
 
-        resp = HttpResponse(content_type="image/%s" % ext)
+        resp = HttpResponse(content=content, content_type="image/%s" % ext)
         resp["Cache-Control"] = 'max-age=%s' % self.lifetime
-
-        # resize master picture if necessary
-        if targetSize != picture.size:
-            picture = ImageOps.fit(picture, targetSize, Image.ANTIALIAS)
-
-        # transfert picture content in response
-        save_as = ext
-        if ext == "jpg":
-            save_as = "JPEG"
-        picture.save(resp, save_as)
-
-        if self.saveThumbnail:
-            f = ContentFile(resp.content)
-            self.storage.save(filename, f)
-
         return resp
@@ -0,0 +1,69 @@
+# -*- coding: utf-8 -*-
+"""
+    djam.uploads
+    ~~~~~~~~~~~~
+
+    Upload handlers keeping memory use bounded whatever the size of the
+    uploaded files.
+
+    :email: devel@amvtek.com
+"""
+from __future__ import unicode_literals, absolute_import
+
+from django.core.exceptions import SuspiciousOperation
+from django.core.files.storage import default_storage
+from django.core.files.uploadhandler import (
+    FileUploadHandler, TemporaryFileUploadHandler
+)
+
+__all__ = ['UploadTooLarge', 'SizeLimitUploadHandler', 'StorageUploadHandler']
+
+
+class UploadTooLarge(SuspiciousOperation):
+    "raised when uploaded files exceed configured size limit..."
+    pass
+
+
+class SizeLimitUploadHandler(FileUploadHandler):
+    """
+    Abort upload as soon as the total size of the uploaded files exceeds
+    maxSize bytes. It shall be the first of the request upload handlers.
+    """
+
+    def __init__(self, maxSize, request=None):
+        super(SizeLimitUploadHandler, self).__init__(request)
+        self.maxSize = maxSize
+        self.received = 0
+
+    def receive_data_chunk(self, raw_data, start):
+        self.received += len(raw_data)
+        if self.received > self.maxSize:
+            raise UploadTooLarge(
+                "uploaded files exceed %i bytes" % self.maxSize
+            )
+        return raw_data
+
+    def file_complete(self, file_size):
+        return None
+
+
+class StorageUploadHandler(TemporaryFileUploadHandler):
+    """
+    Stream uploaded file in chunks to a temporary file, then save it in
+    storage under prefix. Returned UploadedFile has storage_name attribute
+    set to the name the file was saved with.
+    """
+
+    def __init__(self, storage=None, prefix='uploads/', request=None):
+        super(StorageUploadHandler, self).__init__(request)
+        self.storage = storage or default_storage
+        self.prefix = prefix
+
+    def file_complete(self, file_size):
+        upload = super(StorageUploadHandler, self).file_complete(file_size)
+        upload.seek(0)
+        upload.storage_name = self.storage.save(
+            "%s%s" % (self.prefix, upload.name), upload
+        )
+        upload.seek(0)
+        return upload
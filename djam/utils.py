@@ -7,10 +7,12 @@
 """
 from __future__ import unicode_literals, division
 
-import os, re, hashlib, threading, string
+import os, re, time, hashlib, threading, string
 from binascii import hexlify
+from collections import OrderedDict
 
 from django.conf import settings
+from django.utils.http import parse_etags, parse_http_date_safe
 from django.utils import six
 
 class SharedStateBase(object):
@@ -110,6 +112,109 @@ def get_cbv_object(viewfunc):
         return None
 
 
+def _etag_value(etag):
+    "return opaque part of etag, used for weak comparison..."
+
+    if etag.startswith('W/'):
+        etag = etag[2:]
+    return etag.strip('"')
+
+def is_not_modified(request, etag=None, lastModified=None):
+    """
+    return True if client copy of resource validated by quoted etag and/or
+    lastModified timestamp is still valid, evaluating If-None-Match or
+    If-Modified-Since request headers...
+    """
+
+    # If-None-Match takes precedence over If-Modified-Since
+    # See : https://tools.ietf.org/html/rfc7232#section-6
+    inm = request.META.get('HTTP_IF_NONE_MATCH')
+    if inm is not None:
+        if etag is None:
+            return False
+        # weak comparison is used for GET & HEAD
+        tags = set(_etag_value(t) for t in parse_etags(inm))
+        return '*' in tags or _etag_value(etag) in tags
+
+    ims = request.META.get('HTTP_IF_MODIFIED_SINCE')
+    if ims is not None and lastModified is not None:
+        ims = parse_http_date_safe(ims)
+        return ims is not None and lastModified <= ims
+
+    return False
+
+
+class LRUCache(object):
+    """
+    Thread safe LRU cache holding at most maxEntries entries and/or at most
+    maxBytes, the size of an entry being given when it is put. Entries
+    expire after ttl seconds if ttl is set.
+    """
+
+    def __init__(self, maxEntries=None, maxBytes=None, ttl=None):
+
+        self.maxEntries = maxEntries
+        self.maxBytes = maxBytes
+        self.ttl = ttl
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # key : (expires, nbytes, value)
+        self.bytes = 0
+        self.hits = 0
+        self.misses = 0
+
+    def _full(self):
+        return (self.maxBytes is not None and self.bytes > self.maxBytes) or \
+            (self.maxEntries is not None and len(self._entries) > self.maxEntries)
+
+    def get(self, key):
+        "return cached value or None"
+
+        with self._lock:
+            item = self._entries.pop(key, None)
+            if item is not None and item[0] is not None and \
+                    item[0] < time.time():
+                self.bytes -= item[1]
+                item = None
+            if item is None:
+                self.misses += 1
+                return None
+
+            # move to most recently used end
+            self._entries[key] = item
+            self.hits += 1
+            return item[2]
+
+    def put(self, key, value, nbytes=0):
+
+        if self.maxBytes is not None and nbytes > self.maxBytes:
+            return
+
+        expires = None if self.ttl is None else time.time() + self.ttl
+        with self._lock:
+            old = self._entries.pop(key, None)
+            if old is not None:
+                self.bytes -= old[1]
+            self._entries[key] = (expires, nbytes, value)
+            self.bytes += nbytes
+            while self._full():
+                k, (e, n, v) = self._entries.popitem(last=False)
+                self.bytes -= n
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses
+            rv = dict(
+                hits=self.hits, misses=self.misses, entries=len(self._entries),
+                hitRatio=(float(self.hits) / lookups) if lookups else None
+            )
+            if self.maxBytes is not None:
+                rv.update(bytes=self.bytes, maxBytes=self.maxBytes)
+            if self.maxEntries is not None:
+                rv.update(maxEntries=self.maxEntries)
+            return rv
+
+
 _STEPS = range(4, 0, -1)  # cache possible formatting steps
 _SEPARATORS = string.whitespace + "_-"
 